@@ -2,16 +2,34 @@ from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_mail import Mail
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_pagedown import PageDown
 from config import config
+from .cache import ResponseCache
+from .routing import RoutingSQLAlchemy
+from .hashing import PasswordHasher
+from .last_seen import LastSeenBuffer
+from .rendering import HtmlRenderer
+from .hardware_index import HardwareIndex
+from .fulltext import FullTextIndex
+from .similarity import SimilarityIndex
+from .metrics import MetricsRegistry
+from .outbox import MailOutbox
 
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 pagedown = PageDown()
+response_cache = ResponseCache()
+password_hasher = PasswordHasher()
+last_seen_buffer = LastSeenBuffer()
+html_renderer = HtmlRenderer()
+hardware_index = HardwareIndex()
+fulltext_index = FullTextIndex()
+similarity_index = SimilarityIndex()
+metrics_registry = MetricsRegistry()
+mail_outbox = MailOutbox()
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
@@ -28,6 +46,23 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    response_cache.init_app(app)
+    password_hasher.init_app(app)
+    last_seen_buffer.init_app(app)
+    html_renderer.init_app(app)
+    hardware_index.init_app(app)
+    similarity_index.init_app(app)
+    metrics_registry.init_app(app)
+    mail_outbox.init_app(app)
+
+    from .rendering import render_cache
+    metrics_registry.track_cache('response', response_cache)
+    metrics_registry.track_cache('render', render_cache)
+    metrics_registry.add_collector(password_hasher.metrics)
+    metrics_registry.add_collector(mail_outbox.metrics)
+    if 'rivalrockets_log' in app.extensions:
+        metrics_registry.add_collector(
+            app.extensions['rivalrockets_log'].metrics)
 
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
         from flask_sslify import SSLify
@@ -3,5 +3,8 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import authentication, machines, revisions, users, comments, errors
+# before_request handlers run in import order: authenticate first, so the
+# user lookups stay on the primary, and only then route reads to a replica
+from . import authentication, routing, encoding, machines, revisions, users, \
+    comments, errors, batch, export, search, stats, metrics
 
@@ -1,11 +1,86 @@
-from flask import g, jsonify
+import hashlib
+import hmac
+import time
+from flask import g, current_app, request
 from flask_httpauth import HTTPBasicAuth
-from ..models import User, AnonymousUser
+from .. import db, metrics_registry
+from ..cache import LRUCache
+from ..models import User, Role, AnonymousUser
 from . import api
+from .encoding import jsonify
 from .errors import unauthorized, forbidden
 
 auth = HTTPBasicAuth()
 
+# token -> (user id, expiration); saves the HMAC check on repeated requests
+token_cache = LRUCache(max_entries=10000)
+# user id -> detached User with its role loaded, private to this worker
+user_cache = LRUCache(max_entries=1000)
+# digest of (client, email, password, password hash) for recent Basic logins
+credential_cache = LRUCache(max_entries=10000)
+metrics_registry.track_cache('token', token_cache)
+metrics_registry.track_cache('user', user_cache)
+metrics_registry.track_cache('credential', credential_cache)
+
+
+def load_token_user(token):
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = User.decode_auth_token(token)
+        if claims is None:
+            return None
+        ttl = min(current_app.config['RIVALROCKETS_TOKEN_CACHE_TTL'],
+                  claims[1] - time.time())
+        token_cache.set(token, claims, ttl=ttl)
+    return load_user(claims[0])
+
+
+def load_user(id):
+    user = user_cache.get(id)
+    if user is None:
+        user = User.query.options(db.joinedload('role')).get(id)
+        if user is None:
+            return None
+        db.session.expunge(user)
+        if user.role is not None:
+            db.session.expunge(user.role)
+        user_cache.set(id, user,
+                       ttl=current_app.config['RIVALROCKETS_USER_CACHE_TTL'])
+    return db.session.merge(user, load=False)
+
+
+def verify_credentials(user, password):
+    ttl = current_app.config['RIVALROCKETS_CREDENTIAL_CACHE_TTL']
+    if not ttl:
+        return user.verify_password(password)
+    # the stored hash is part of the key, so a password change invalidates it
+    key = hmac.new(
+        current_app.config['SECRET_KEY'].encode('utf-8'),
+        '\0'.join((request.remote_addr or '', user.email, password,
+                   user.password_hash or '')).encode('utf-8'),
+        hashlib.sha256).hexdigest()
+    if credential_cache.get(key):
+        return True
+    verified = user.verify_password(password)
+    if verified:
+        credential_cache.set(key, True, ttl=ttl)
+    return verified
+
+
+def forget_user(target, value, oldvalue, initiator):
+    if target.id is not None:
+        user_cache.delete(target.id)
+
+
+def forget_all_users(target, value, oldvalue, initiator):
+    user_cache.clear()
+
+
+for attribute in (User.password_hash, User.email, User.confirmed,
+                  User.role_id, User.role):
+    db.event.listen(attribute, 'set', forget_user)
+db.event.listen(Role.permissions, 'set', forget_all_users)
+
 
 @auth.verify_password
 def verify_password(email_or_token, password):
@@ -13,7 +88,7 @@ def verify_password(email_or_token, password):
         g.current_user = AnonymousUser()
         return True
     if password == '':
-        g.current_user = User.verify_auth_token(email_or_token)
+        g.current_user = load_token_user(email_or_token)
         g.token_used = True
         return g.current_user is not None
     user = User.query.filter_by(email=email_or_token).first()
@@ -21,7 +96,7 @@ def verify_password(email_or_token, password):
         return False
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    return verify_credentials(user, password)
 
 
 @auth.error_handler
@@ -42,4 +117,4 @@ def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized('Invalid credentials')
     return jsonify({'token': g.current_user.generate_auth_token(
-        expiration=3600), 'expiration': 3600})
\ No newline at end of file
+        expiration=3600), 'expiration': 3600})
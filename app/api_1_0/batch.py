@@ -0,0 +1,292 @@
+import json
+from collections import OrderedDict
+from flask import request, g, current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from .. import db, response_cache, hardware_index, similarity_index, \
+    fulltext_index
+from ..exceptions import ValidationError
+from ..models import Machine, Revision, Permission, TableVersion, \
+    HardwareRollup, recount
+from ..rendering import render_html
+from . import api
+from .encoding import jsonify
+from .decorators import permission_required
+from .errors import conflict
+
+# rows per IN list / executemany round trip
+CHUNK_SIZE = 500
+
+MACHINE_COLUMNS = ('system_name', 'system_notes', 'system_notes_html',
+                   'owner')
+REVISION_COLUMNS = Revision.EDITABLE_FIELDS + ('revision_notes_html',
+                                               'machine_id')
+
+# record fields whose values go into Core statements unchecked, by the
+# column they are compared with or written to
+MACHINE_FIELDS = dict((name, Machine.__table__.c[name])
+                      for name in MACHINE_COLUMNS)
+REVISION_FIELDS = dict((name, Revision.__table__.c[name])
+                       for name in REVISION_COLUMNS)
+REVISION_FIELDS['machine_external_id'] = Machine.__table__.c.external_id
+
+
+def chunks(values, size=CHUNK_SIZE):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def read_records():
+    if request.mimetype == 'application/x-ndjson':
+        try:
+            records = [json.loads(line) for line in
+                       request.get_data(as_text=True).splitlines()
+                       if line.strip()]
+        except ValueError:
+            raise ValidationError('malformed NDJSON body')
+    else:
+        records = request.get_json()
+    if not isinstance(records, list):
+        raise ValidationError('batch must be a JSON array or NDJSON')
+    limit = current_app.config['RIVALROCKETS_BATCH_MAX_RECORDS']
+    if len(records) > limit:
+        raise ValidationError('batch has more than %d records' % limit)
+    return records
+
+
+def check_types(record, fields):
+    for name, column in fields.items():
+        value = record.get(name)
+        if value is None:
+            continue
+        if isinstance(column.type, db.Integer):
+            if not isinstance(value, int) or isinstance(value, bool) or \
+                    not -2 ** 31 <= value < 2 ** 31:
+                raise ValidationError('%s must be an integer' % name)
+        elif isinstance(column.type, db.String):
+            length = column.type.length
+            if not isinstance(value, str):
+                raise ValidationError('%s must be a string' % name)
+            if length is not None and len(value) > length:
+                raise ValidationError('%s is longer than %d characters' %
+                                      (name, length))
+
+
+def validate(records, from_json, columns, fields):
+    results = [None] * len(records)
+    rows = OrderedDict()
+    for index, record in enumerate(records):
+        external_id = None
+        try:
+            if not isinstance(record, dict):
+                raise ValidationError('record is not an object')
+            external_id = record.get('external_id')
+            if not isinstance(external_id, str) or \
+                    not 0 < len(external_id) <= 64:
+                raise ValidationError('record does not have external_id')
+            if external_id in rows:
+                raise ValidationError('external_id repeated in batch')
+            check_types(record, fields)
+            instance = from_json(record)
+        except ValidationError as e:
+            results[index] = {'external_id': external_id, 'status': 'error',
+                              'message': e.args[0]}
+            continue
+        rows[external_id] = (index, dict((column, getattr(instance, column))
+                                         for column in columns))
+    return results, rows
+
+
+def upsert(table, rows, author_id):
+    """Insert or replace ``rows`` (external id -> (index, values)).
+
+    Returns a dict mapping each external id to ``(id, created)``.
+    """
+    existing = {}
+    for chunk in chunks(list(rows)):
+        existing.update(db.session.execute(
+            db.select([table.c.external_id, table.c.id]).
+            where(table.c.author_id == author_id).
+            where(table.c.external_id.in_(chunk))).fetchall())
+    inserts = []
+    updates = []
+    for external_id, (index, values) in rows.items():
+        if external_id in existing:
+            params = dict(('v_' + key, value) for key, value in values.items())
+            params['row_id'] = existing[external_id]
+            updates.append(params)
+        else:
+            inserts.append(dict(values, external_id=external_id,
+                                author_id=author_id))
+    for chunk in chunks(inserts):
+        db.session.execute(table.insert(), chunk)
+    for chunk in chunks(updates):
+        db.session.execute(
+            table.update().where(table.c.id == bindparam('row_id')).
+            values(dict((key, bindparam('v_' + key))
+                        for key in rows[next(iter(rows))][1])),
+            chunk)
+    written = dict((external_id, (id, False))
+                   for external_id, id in existing.items())
+    for chunk in chunks([row['external_id'] for row in inserts]):
+        written.update(
+            (external_id, (id, True)) for external_id, id in
+            db.session.execute(
+                db.select([table.c.external_id, table.c.id]).
+                where(table.c.author_id == author_id).
+                where(table.c.external_id.in_(chunk))).fetchall())
+    return written
+
+
+def rollup_values(table, column, keys, author_id=None):
+    for chunk in chunks(keys):
+        query = db.select([table.c[name] for name in HardwareRollup.COLUMNS]).\
+            where(table.c[column].in_(chunk))
+        if author_id is not None:
+            query = query.where(table.c.author_id == author_id)
+        for row in db.session.execute(query):
+            yield dict(zip(HardwareRollup.COLUMNS, row))
+
+
+def index_documents(kind, rows, written):
+    """Write the search documents of rows upserted through Core."""
+    for document_kind, model, columns in fulltext_index.documents():
+        if document_kind == kind:
+            break
+    fulltext_index.write_many(db.session.connection(), kind, [
+        (written[external_id][0],
+         fulltext_index.body(values[column] for column in columns))
+        for external_id, (index, values) in rows.items()])
+
+
+def report(results, rows, written):
+    for external_id, (index, values) in rows.items():
+        id, created = written[external_id]
+        results[index] = {'external_id': external_id, 'id': id,
+                          'status': 'created' if created else 'updated'}
+    statuses = [result['status'] for result in results]
+    return {
+        'results': results,
+        'created': statuses.count('created'),
+        'updated': statuses.count('updated'),
+        'errors': statuses.count('error')
+    }
+
+
+def commit():
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    return True
+
+
+@api.route('/machines/batch', methods=['POST'])
+@permission_required(Permission.CREATE_MACHINE_DATA)
+def upsert_machines():
+    author_id = g.current_user.id
+    results, rows = validate(read_records(), Machine.from_json,
+                             MACHINE_COLUMNS, MACHINE_FIELDS)
+    for index, values in rows.values():
+        values['system_notes_html'] = render_html(values['system_notes'])
+    written = {}
+    if rows:
+        written = upsert(Machine.__table__, rows, author_id)
+        index_documents('machine', rows, written)
+        recount(Machine, 'author_id', [author_id])
+        TableVersion.bump(db.session, ['machines', 'users'])
+    if not commit():
+        return conflict('batch raced with a concurrent write, retry it')
+    response_cache.invalidate(
+        'machines', 'user:%d' % author_id, 'user:%d:machines' % author_id,
+        *['machine:%d' % id for id, created in written.values()
+          if not created])
+    return jsonify(report(results, rows, written))
+
+
+@api.route('/revisions/batch', methods=['POST'])
+@permission_required(Permission.CREATE_MACHINE_DATA)
+def upsert_revisions():
+    author_id = g.current_user.id
+    records = read_records()
+    results, rows = validate(records, Revision.from_json, REVISION_COLUMNS,
+                             REVISION_FIELDS)
+
+    # resolve each record's machine by our id or the caller's external id
+    machine_ids = set()
+    machine_external_ids = set()
+    for index, values in rows.values():
+        record = records[index]
+        if record.get('machine_external_id') is not None:
+            machine_external_ids.add(record['machine_external_id'])
+        elif record.get('machine_id') is not None:
+            machine_ids.add(record['machine_id'])
+    machines = Machine.__table__
+    by_id = {}
+    by_external_id = {}
+    for chunk in chunks(sorted(machine_ids, key=str)):
+        by_id.update((row[0], row) for row in db.session.execute(
+            db.select([machines.c.id, machines.c.author_id]).
+            where(machines.c.id.in_(chunk))))
+    for chunk in chunks(sorted(machine_external_ids, key=str)):
+        by_external_id.update((row[2], row) for row in db.session.execute(
+            db.select([machines.c.id, machines.c.author_id,
+                       machines.c.external_id]).
+            where(machines.c.author_id == author_id).
+            where(machines.c.external_id.in_(chunk))))
+    for external_id, (index, values) in list(rows.items()):
+        record = records[index]
+        if record.get('machine_external_id') is not None:
+            machine = by_external_id.get(record['machine_external_id'])
+        else:
+            machine = by_id.get(record.get('machine_id'))
+        if machine is None:
+            del rows[external_id]
+            results[index] = {'external_id': external_id, 'status': 'error',
+                              'message': 'revision does not have a machine'}
+            continue
+        values['machine_id'] = machine[0]
+        values['revision_notes_html'] = render_html(values['revision_notes'])
+
+    written = {}
+    affected = set()
+    if rows:
+        revisions = Revision.__table__
+        # revisions that move to another machine change its old count too
+        for chunk in chunks(list(rows)):
+            affected.update(row[0] for row in db.session.execute(
+                db.select([revisions.c.machine_id]).
+                where(revisions.c.author_id == author_id).
+                where(revisions.c.external_id.in_(chunk))))
+        affected.update(values['machine_id'] for index, values in rows.values())
+        affected.discard(None)
+        deltas = {}
+        for values in rollup_values(revisions, 'external_id', list(rows),
+                                    author_id):
+            HardwareRollup.accumulate(deltas, values, -1)
+        written = upsert(revisions, rows, author_id)
+        index_documents('revision', rows, written)
+        for values in rollup_values(revisions, 'id', [
+                id for id, created in written.values()]):
+            HardwareRollup.accumulate(deltas, values, 1)
+        HardwareRollup.apply(db.session, deltas)
+        for chunk in chunks(sorted(affected)):
+            recount(Revision, 'machine_id', chunk)
+        TableVersion.bump(db.session, ['revisions', 'machines'])
+    if not commit():
+        return conflict('batch raced with a concurrent write, retry it')
+    if rows:
+        # rows written through Core bypass the index's session events
+        hardware_index.stale = True
+        similarity_index.stale = True
+    authors = set(machine[1] for machine in
+                  list(by_id.values()) + list(by_external_id.values()))
+    response_cache.invalidate(
+        'revisions', 'machines',
+        *(['revision:%d' % id for id, created in written.values()
+           if not created] +
+          ['machine:%d' % id for id in affected] +
+          ['machine:%d:revisions' % id for id in affected] +
+          ['user:%s:machines' % id for id in authors]))
+    return jsonify(report(results, rows, written))
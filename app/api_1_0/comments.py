@@ -1,56 +1,52 @@
-from flask import jsonify, request, g, url_for, current_app
-from .. import db
+from flask import request, g, url_for, current_app
+from .. import db, response_cache
 from ..models import Machine, Permission, Comment
 from . import api
-from .decorators import permission_required
+from .encoding import jsonify
+from .decorators import permission_required, conditional, cached
+from .pagination import paginate
+from .serializers import comment_serializer
 
 
 @api.route('/comments/')
+@conditional('comments', weak=True)
+@cached('comments')
 def get_comments():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['RIVALROCKETS_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page+1, _external=True)
+    page = paginate(
+        comment_serializer.query().order_by(Comment.timestamp.desc()),
+        Comment, 'api.get_comments',
+        per_page=current_app.config['RIVALROCKETS_COMMENTS_PER_PAGE'])
     return jsonify({
-        'comments': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
+        'comments': comment_serializer.dump_all(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
     })
 
 
 @api.route('/comments/<int:id>')
+@conditional('comments')
+@cached('comment:{id}')
 def get_comment(id):
-    comment = Comment.query.get_or_404(id)
-    return jsonify(comment.to_json())
+    return jsonify(comment_serializer.get_or_404(id))
 
 
 @api.route('/machines/<int:id>/comments/')
+@conditional('machines', 'comments', weak=True)
+@cached('machine:{id}:comments')
 def get_machine_comments(id):
-    machine = Machine.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = machine.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['RIVALROCKETS_COMMENTS_PER_PAGE'],
-        error_out=False)
-    comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page+1, _external=True)
+    Machine.query.get_or_404(id)
+    page = paginate(
+        comment_serializer.query().filter(Comment.machine_id == id).
+        order_by(Comment.timestamp.asc()), Comment,
+        'api.get_machine_comments',
+        per_page=current_app.config['RIVALROCKETS_COMMENTS_PER_PAGE'],
+        descending=False, id=id)
     return jsonify({
-        'machines': [comment.to_json() for comment in comments],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
+        'machines': comment_serializer.dump_all(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
     })
 
 
@@ -63,6 +59,9 @@ def new_machine_comment(id):
     comment.machine = machine
     db.session.add(comment)
     db.session.commit()
+    response_cache.invalidate('comments', 'machines', 'machine:%d' % id,
+                              'machine:%d:comments' % id,
+                              'user:%s:machines' % machine.author_id)
     return jsonify(comment.to_json()), 201, \
            {'Location': url_for('api.get_comment', id=comment.id,
                              _external=True)}
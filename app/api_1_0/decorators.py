@@ -1,6 +1,11 @@
+import hashlib
 from functools import wraps
-from flask import g
+from flask import g, request, current_app, make_response
+from .. import response_cache
+from ..models import TableVersion
+from .encoding import negotiated_mimetype
 from .errors import forbidden
+from .serializers import expanded_tables
 
 
 def permission_required(permission):
@@ -12,3 +17,75 @@ def permission_required(permission):
             return f(*args, **kwargs)
         return decorated_function
     return decorator
+
+
+def conditional(*tables, weak=False):
+    """Validate GET responses against the version counters of ``tables``.
+
+    The ETag is derived from the request URL (which carries the host used in
+    the external links) and the current table versions, so a matching
+    ``If-None-Match`` is answered with a 304 before the view runs.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+            # embedded resources make the response depend on their tables too
+            names = tuple(sorted(set(tables + expanded_tables())))
+            etag = hashlib.sha1(repr((
+                request.url, negotiated_mimetype(), names,
+                TableVersion.current(names))).encode('utf-8')).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=weak)
+            if g.current_user.is_anonymous:
+                response.headers['Cache-Control'] = 'public, no-cache'
+            else:
+                response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Authorization')
+            return response
+        return decorated_function
+    return decorator
+
+
+def cached(*tags):
+    """Serve GET responses from the response cache.
+
+    ``tags`` are formatted with the view arguments; write endpoints evict
+    every entry carrying a tag through ``response_cache.invalidate``.
+    Responses with embedded resources are also tagged with the collection
+    tag of each expanded table.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET':
+                return f(*args, **kwargs)
+            if g.current_user.is_anonymous:
+                scope = 'anonymous'
+            else:
+                scope = 'user:%d' % g.current_user.id
+            scope += '|' + negotiated_mimetype()
+            key = response_cache.make_key(request.endpoint, request.url, scope)
+            entry = response_cache.get(key)
+            if entry is not None:
+                status, headers, body = entry
+                return current_app.response_class(body, status=status,
+                                                  headers=headers)
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(
+                    key,
+                    (response.status_code, list(response.headers),
+                     response.get_data()),
+                    response_cache.ttl_for(request.endpoint),
+                    [tag.format(**kwargs) for tag in tags] +
+                    list(expanded_tables()))
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,157 @@
+import calendar
+import zlib
+from datetime import datetime
+from flask import request, current_app, jsonify as json_response
+from ..exceptions import NotAcceptable
+from . import api
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+
+# 'application/x-msgpack' is what most msgpack clients still send
+MIMETYPES = (JSON, MSGPACK, 'application/x-msgpack', CBOR)
+
+# the library that encodes each binary mimetype
+CODECS = {
+    MSGPACK: 'msgpack',
+    CBOR: 'cbor2',
+}
+
+COMPRESSIBLE = (JSON, MSGPACK, CBOR, 'application/x-ndjson', 'text/csv')
+
+CODINGS = ('gzip', 'deflate')
+
+# zlib window bits selecting the container of each content coding
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+# mimetype -> whether its codec imports, filled in on first use
+available = {}
+
+
+def codec_available(mimetype):
+    if mimetype not in CODECS:
+        return True
+    if mimetype not in available:
+        try:
+            __import__(CODECS[mimetype])
+        except ImportError:
+            available[mimetype] = False
+        else:
+            available[mimetype] = True
+    return available[mimetype]
+
+
+def negotiated_mimetype():
+    """Return the body mimetype the request's ``Accept`` header prefers.
+
+    Only mimetypes whose codec is installed are offered, so the ETag and
+    cache key always name the representation actually sent.
+    """
+    mimetype = request.accept_mimetypes.best_match(
+        [m for m in MIMETYPES if codec_available(normalized(m))],
+        default=JSON)
+    return normalized(mimetype)
+
+
+def normalized(mimetype):
+    if mimetype == 'application/x-msgpack':
+        return MSGPACK
+    return mimetype
+
+
+@api.before_request
+def check_acceptable():
+    """Refuse requests for a binary encoding the server cannot produce.
+
+    When the client also accepts JSON it simply gets JSON.
+    """
+    wanted = request.accept_mimetypes.best_match(MIMETYPES)
+    if wanted is not None and not codec_available(normalized(wanted)) and \
+            not request.accept_mimetypes[JSON]:
+        raise NotAcceptable('%s responses are not available' %
+                            normalized(wanted))
+
+
+def plain(obj):
+    """Copy ``obj`` with datetimes turned into UNIX times."""
+    if isinstance(obj, datetime):
+        return calendar.timegm(obj.utctimetuple())
+    if isinstance(obj, dict):
+        return dict((key, plain(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [plain(value) for value in obj]
+    return obj
+
+
+def encode(obj, mimetype):
+    if mimetype == MSGPACK:
+        import msgpack
+        return msgpack.packb(plain(obj), use_bin_type=True)
+    import cbor2
+    return cbor2.dumps(plain(obj))
+
+
+def jsonify(*args, **kwargs):
+    """Drop-in for ``flask.jsonify`` that honours the ``Accept`` header.
+
+    MessagePack and CBOR bodies are produced when the client prefers them;
+    everything else gets the usual JSON.
+    """
+    mimetype = negotiated_mimetype()
+    if mimetype != JSON:
+        obj = args[0] if len(args) == 1 and not kwargs else \
+            dict(*args, **kwargs)
+        return current_app.response_class(encode(obj, mimetype),
+                                          mimetype=mimetype)
+    return json_response(*args, **kwargs)
+
+
+def compressed(chunks, coding, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[coding])
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@api.after_request
+def compress(response):
+    """Apply the content coding the client accepts to large bodies.
+
+    Buffered bodies are compressed when they reach
+    ``RIVALROCKETS_API_COMPRESS_MIN_BYTES``; streamed ones always are, one
+    chunk at a time, so exports are never held in memory.
+    """
+    response.vary.add('Accept')
+    if response.mimetype not in COMPRESSIBLE or \
+            response.status_code in (204, 206, 304) or \
+            response.direct_passthrough or \
+            'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = request.accept_encodings.best_match(CODINGS)
+    if coding is None:
+        return response
+    level = current_app.config['RIVALROCKETS_API_COMPRESS_LEVEL']
+    if response.is_streamed:
+        response.response = compressed(response.response, coding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['RIVALROCKETS_API_COMPRESS_MIN_BYTES']:
+            return response
+        response.set_data(b''.join(compressed([body], coding, level)))
+    response.headers['Content-Encoding'] = coding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        # a strong tag must differ between codings of the same entity
+        response.set_etag(etag, weak=True)
+    return response
@@ -1,6 +1,6 @@
-from flask import jsonify
-from app.exceptions import ValidationError
+from app.exceptions import ValidationError, ServiceUnavailable, NotAcceptable
 from . import api
+from .encoding import jsonify
 
 
 def bad_request(message):
@@ -21,6 +21,35 @@ def forbidden(message):
     return response
 
 
+def not_acceptable(message):
+    response = jsonify({'error': 'not acceptable', 'message': message})
+    response.status_code = 406
+    return response
+
+
+def conflict(message):
+    response = jsonify({'error': 'conflict', 'message': message})
+    response.status_code = 409
+    return response
+
+
+def service_unavailable(message):
+    response = jsonify({'error': 'service unavailable', 'message': message})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
 @api.errorhandler(ValidationError)
 def validation_error(e):
-    return bad_request(e.args[0])
\ No newline at end of file
+    return bad_request(e.args[0])
+
+
+@api.errorhandler(NotAcceptable)
+def not_acceptable_error(e):
+    return not_acceptable(e.args[0])
+
+
+@api.errorhandler(ServiceUnavailable)
+def service_unavailable_error(e):
+    return service_unavailable(e.args[0])
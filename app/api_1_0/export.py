@@ -0,0 +1,117 @@
+import io
+import json
+from datetime import datetime
+from flask import request, current_app, stream_with_context, send_file
+from .. import db
+from .. import columnar
+from ..exceptions import ValidationError, NotAcceptable
+from ..models import Permission
+from . import api
+from .decorators import permission_required
+from .serializers import machine_serializer, revision_serializer, \
+    comment_serializer
+
+SINCE_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d')
+
+
+def parse_since(value):
+    try:
+        return datetime.utcfromtimestamp(float(value))
+    except (OverflowError, OSError):
+        raise ValidationError('since is out of range')
+    except ValueError:
+        pass
+    for format in SINCE_FORMATS:
+        try:
+            return datetime.strptime(value.rstrip('Z'), format)
+        except ValueError:
+            pass
+    raise ValidationError('since must be an ISO 8601 time or a UNIX time')
+
+
+def export(serializer):
+    """Stream every row of a resource as NDJSON.
+
+    Rows are read through a server-side cursor in batches of
+    ``RIVALROCKETS_EXPORT_BATCH_SIZE``, so memory use does not depend on
+    the size of the table. ``since`` selects the rows created or changed
+    at or after that time.
+    """
+    model = serializer.model
+    query = serializer.select().order_by(model.id)
+    since = request.args.get('since')
+    if since:
+        query = query.where(model.updated_at >= parse_since(since))
+    plan = serializer.plan()
+    batch_size = current_app.config['RIVALROCKETS_EXPORT_BATCH_SIZE']
+    encoder = current_app.json_encoder
+
+    def generate():
+        connection = db.engine.connect()
+        try:
+            result = connection.execution_options(stream_results=True).\
+                execute(query)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield ''.join(json.dumps(serializer.dump(row, plan),
+                                         cls=encoder, sort_keys=True) + '\n'
+                              for row in rows)
+        finally:
+            connection.close()
+
+    return current_app.response_class(stream_with_context(generate()),
+                                      mimetype='application/x-ndjson')
+
+
+@api.route('/export/machines')
+def export_machines():
+    return export(machine_serializer)
+
+
+@api.route('/export/revisions')
+def export_revisions():
+    return export(revision_serializer)
+
+
+@api.route('/export/comments')
+def export_comments():
+    return export(comment_serializer)
+
+
+@api.route('/export/revisions.<format>')
+@permission_required(Permission.ADMINISTER)
+def export_revision_columns(format):
+    if format not in columnar.FORMATS:
+        raise ValidationError('format must be one of %s' %
+                              ', '.join(columnar.FORMATS))
+    try:
+        columnar.require_format(format)
+    except ImportError as e:
+        raise NotAcceptable('%s export is not available: %s' % (format, e))
+    batch_size = current_app.config['RIVALROCKETS_EXPORT_BATCH_SIZE']
+    if format in ('csv', 'arrow'):
+        encode = columnar.csv_chunks if format == 'csv' else \
+            columnar.arrow_chunks
+
+        def generate():
+            connection = db.engine.connect()
+            try:
+                for data in encode(
+                        columnar.revision_chunks(connection, batch_size)):
+                    yield data
+            finally:
+                connection.close()
+        return current_app.response_class(stream_with_context(generate()),
+                                          mimetype=columnar.MIMETYPES[format])
+    buffer = io.BytesIO()
+    connection = db.engine.connect()
+    try:
+        columnar.write_revisions(connection, format, buffer, batch_size)
+    finally:
+        connection.close()
+    buffer.seek(0)
+    return send_file(buffer, mimetype=columnar.MIMETYPES[format],
+                     as_attachment=True,
+                     attachment_filename='revisions.' + format)
@@ -1,36 +1,37 @@
-from flask import jsonify, request, g, abort, url_for, current_app
-from .. import db
+import math
+from flask import request, g, abort, url_for, current_app
+from .. import db, response_cache, similarity_index
+from ..exceptions import ValidationError, NotAcceptable
 from ..models import Machine, Permission
+from ..similarity import FEATURES, NUMERIC_FEATURES
 from . import api
-from .decorators import permission_required
+from .encoding import jsonify
+from .decorators import permission_required, conditional, cached
 from .errors import forbidden
+from .pagination import paginate
+from .serializers import machine_serializer
 
 
 @api.route('/machines/')
+@conditional('machines', weak=True)
+@cached('machines')
 def get_machines():
-    page = request.args.get('page', 1, type=int)
-    pagination = Machine.query.paginate(
-        page, per_page=current_app.config['RIVALROCKETS_MACHINES_PER_PAGE'],
-        error_out=False)
-    machines = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_machines', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_machines', page=page+1, _external=True)
+    page = paginate(
+        machine_serializer.query(), Machine, 'api.get_machines',
+        per_page=current_app.config['RIVALROCKETS_MACHINES_PER_PAGE'])
     return jsonify({
-        'machines': [machine.to_json() for machine in machines],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
+        'machines': machine_serializer.dump_all(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
     })
 
 
 @api.route('/machines/<int:id>')
+@conditional('machines')
+@cached('machine:{id}')
 def get_machine(id):
-    machine = Machine.query.get_or_404(id)
-    return jsonify(machine.to_json())
+    return jsonify(machine_serializer.get_or_404(id))
 
 
 @api.route('/machines/', methods=['POST'])
@@ -40,6 +41,8 @@ def new_machine():
     machine.author = g.current_user
     db.session.add(machine)
     db.session.commit()
+    response_cache.invalidate('machines', 'user:%s' % machine.author_id,
+                              'user:%s:machines' % machine.author_id)
     return jsonify(machine.to_json()), 201, \
         {'Location': url_for('api.get_machine', id=machine.id, _external=True)}
 
@@ -48,11 +51,69 @@ def new_machine():
 @permission_required(Permission.CREATE_MACHINE_DATA)
 def edit_machine(id):
     machine = Machine.query.get_or_404(id)
-    if g.current_user != machine.author_id and \
+    if g.current_user != machine.author and \
             not g.current_user.can(Permission.ADMINISTER):
         return forbidden('Insufficient permissions')
     machine.system_name = request.json.get('system_name', machine.system_name)
     machine.system_notes = request.json.get('system_notes', machine.system_notes)
     db.session.add(machine)
+    db.session.commit()
+    response_cache.invalidate('machines', 'machine:%d' % machine.id,
+                              'user:%s:machines' % machine.author_id)
     return jsonify(machine.to_json())
 
+
+def similar_machines(spec, exclude=None):
+    try:
+        k = int(request.args.get('k', 10))
+    except ValueError:
+        raise ValidationError('k must be an integer')
+    k = max(1, min(k, current_app.config['RIVALROCKETS_SIMILAR_MACHINES_MAX']))
+    try:
+        similarity_index.refresh()
+    except ImportError as e:
+        raise NotAcceptable('similarity search is not available: %s' % e)
+    neighbours = similarity_index.nearest(spec, k, exclude=exclude)
+    rows = {}
+    if neighbours:
+        rows = dict((row.id, row) for row in machine_serializer.query().filter(
+            Machine.id.in_([id for id, distance in neighbours])))
+    neighbours = [(id, distance) for id, distance in neighbours if id in rows]
+    machines = machine_serializer.dump_all([rows[id] for id, distance
+                                            in neighbours])
+    return jsonify({
+        'machines': [{'machine': machine, 'distance': distance}
+                     for machine, (id, distance) in zip(machines, neighbours)]
+    })
+
+
+@api.route('/machines/<int:id>/similar')
+def get_similar_machines(id):
+    Machine.query.get_or_404(id)
+    spec = similarity_index.spec_of(id)
+    if spec is None:
+        raise ValidationError('machine has no revisions to compare')
+    return similar_machines(spec, exclude=id)
+
+
+@api.route('/machines/similar', methods=['POST'])
+def find_similar_machines():
+    json_spec = request.json
+    if not isinstance(json_spec, dict):
+        raise ValidationError('spec must be a JSON object')
+    spec = []
+    for name in FEATURES:
+        value = json_spec.get(name)
+        if value is None:
+            pass
+        elif name in NUMERIC_FEATURES:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValidationError('%s must be a number' % name)
+            if not math.isfinite(value):
+                raise ValidationError('%s must be a finite number' % name)
+        elif not isinstance(value, str):
+            raise ValidationError('%s must be a string' % name)
+        spec.append(value)
+    return similar_machines(tuple(spec))
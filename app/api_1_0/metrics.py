@@ -0,0 +1,13 @@
+from flask import current_app
+from .. import metrics_registry
+from ..models import Permission
+from . import api
+from .decorators import permission_required
+
+
+@api.route('/metrics')
+@permission_required(Permission.ADMINISTER)
+def get_metrics():
+    return current_app.response_class(
+        metrics_registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
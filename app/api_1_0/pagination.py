@@ -0,0 +1,118 @@
+import base64
+import binascii
+import time
+from datetime import datetime
+from flask import request, url_for, current_app
+from sqlalchemy import and_, or_
+from ..exceptions import ValidationError
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# (endpoint, view args) -> (expires, count); shared by every request served
+# by this worker so deep cursor crawls do not pay for a COUNT(*) per page.
+_count_cache = {}
+
+
+def encode_cursor(timestamp, id):
+    raw = '%s|%d' % (timestamp.strftime(CURSOR_TIME_FORMAT), id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii') \
+        .rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(
+            (cursor + '=' * (-len(cursor) % 4)).encode('ascii'))
+        timestamp, id = raw.decode('utf-8').rsplit('|', 1)
+        return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValidationError('invalid cursor')
+
+
+def cached_count(query, key):
+    ttl = current_app.config['RIVALROCKETS_COUNT_CACHE_TTL']
+    now = time.time()
+    entry = _count_cache.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    count = query.order_by(None).count()
+    if ttl > 0:
+        _count_cache[key] = (now + ttl, count)
+    return count
+
+
+class Page(object):
+    def __init__(self, items, prev, next, count):
+        self.items = items
+        self.prev = prev
+        self.next = next
+        self.count = count
+
+
+def paginate(query, model, endpoint, per_page, descending=True, **values):
+    """Paginate ``query`` either by page number or by an opaque cursor.
+
+    Requests that carry a ``cursor`` argument (an empty one starts at the
+    beginning) seek on ``(timestamp, id)`` instead of using ``OFFSET``, so
+    every page costs the same no matter how deep the client goes.
+    """
+    cursor = request.args.get('cursor')
+    if cursor is None:
+        return _paginate_by_page(query, endpoint, per_page, **values)
+    return _paginate_by_cursor(query, model, endpoint, per_page, cursor,
+                               descending, **values)
+
+
+def _paginate_by_page(query, endpoint, per_page, **values):
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        page = 1
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    if page == 1 and len(items) < per_page:
+        total = len(items)
+    else:
+        total = query.order_by(None).count()
+    prev = None
+    if page > 1:
+        prev = url_for(endpoint, page=page-1, _external=True, **values)
+    next = None
+    if page * per_page < total:
+        next = url_for(endpoint, page=page+1, _external=True, **values)
+    return Page(items, prev, next, total)
+
+
+def _paginate_by_cursor(query, model, endpoint, per_page, cursor, descending,
+                        **values):
+    count_arg = request.args.get('count', 'estimate')
+    if count_arg == 'exact':
+        count = query.order_by(None).count()
+    elif count_arg == 'none':
+        count = None
+    else:
+        count = cached_count(query, (endpoint,) + tuple(sorted(values.items())))
+
+    if descending:
+        ordering = (model.timestamp.desc(), model.id.desc())
+    else:
+        ordering = (model.timestamp.asc(), model.id.asc())
+    query = query.order_by(None).order_by(*ordering)
+    if cursor:
+        timestamp, id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(and_(
+                model.timestamp <= timestamp,
+                or_(model.timestamp < timestamp, model.id < id)))
+        else:
+            query = query.filter(and_(
+                model.timestamp >= timestamp,
+                or_(model.timestamp > timestamp, model.id > id)))
+    items = query.limit(per_page + 1).all()
+    next = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        if 'count' in request.args:
+            values['count'] = count_arg
+        next = url_for(endpoint, cursor=encode_cursor(last.timestamp, last.id),
+                       _external=True, **values)
+    return Page(items, None, next, count)
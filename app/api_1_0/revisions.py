@@ -1,71 +1,124 @@
-from flask import jsonify, request, g, url_for, current_app
-from .. import db
+from flask import request, g, url_for, current_app
+from .. import db, response_cache, hardware_index
+from ..exceptions import ValidationError
+from ..hardware_index import CATEGORICAL_COLUMNS, NUMERIC_COLUMNS
 from ..models import Machine, Revision, Permission
 from . import api
-from .decorators import permission_required
+from .encoding import jsonify
+from .decorators import permission_required, conditional, cached
 from .errors import forbidden
+from .pagination import paginate
+from .serializers import revision_serializer
 
 
 @api.route('/revisions/')
+@conditional('revisions', weak=True)
+@cached('revisions')
 def get_revisions():
-    page = request.args.get('page', 1, type=int)
-    pagination = Revision.query.order_by(Revision.timestamp.desc()).paginate(
-        page, per_page=current_app.config['RIVALROCKETS_REVISIONS_PER_PAGE'],
-        error_out=False)
-    revisions = pagination.items
+    page = paginate(
+        revision_serializer.query().order_by(Revision.timestamp.desc()),
+        Revision, 'api.get_revisions',
+        per_page=current_app.config['RIVALROCKETS_REVISIONS_PER_PAGE'])
+    return jsonify({
+        'revisions': revision_serializer.dump_all(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
+    })
+
+
+@api.before_app_first_request
+def build_hardware_index():
+    try:
+        hardware_index.ensure_built()
+    except Exception:
+        current_app.logger.exception('Could not build the hardware index')
+
+
+@api.route('/revisions/search')
+def search_revisions():
+    equals = {}
+    for name in CATEGORICAL_COLUMNS:
+        values = request.args.getlist(name)
+        if values:
+            equals[name] = values
+    ranges = {}
+    for name in NUMERIC_COLUMNS:
+        low = request.args.get(name + '_min')
+        high = request.args.get(name + '_max')
+        try:
+            low = int(low) if low is not None else None
+            high = int(high) if high is not None else None
+        except ValueError:
+            raise ValidationError('%s bounds must be integers' % name)
+        if low is not None or high is not None:
+            ranges[name] = (low, high)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['RIVALROCKETS_REVISIONS_PER_PAGE']
+    hardware_index.ensure_built()
+    ids, total, facets = hardware_index.search(
+        equals, ranges, offset=(page - 1) * per_page, limit=per_page)
+    rows = {}
+    if ids:
+        rows = dict((row.id, row) for row in revision_serializer.query().
+                    filter(Revision.id.in_(ids)))
+    args = request.args.to_dict(flat=False)
     prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_revisions', page=page-1, _external=True)
+    if page > 1:
+        args['page'] = [page - 1]
+        prev = url_for('api.search_revisions', _external=True, **args)
     next = None
-    if pagination.has_next:
-        next = url_for('api.get_revisions', page=page+1, _external=True)
+    if page * per_page < total:
+        args['page'] = [page + 1]
+        next = url_for('api.search_revisions', _external=True, **args)
     return jsonify({
-        'revisions': [revision.to_json() for revision in revisions],
+        'revisions': revision_serializer.dump_all(
+            [rows[id] for id in ids if id in rows]),
+        'facets': facets,
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': total
     })
 
 
 @api.route('/revisions/<int:id>')
+@conditional('revisions')
+@cached('revision:{id}')
 def get_revision(id):
-    revision = Revision.query.get_or_404(id)
-    return jsonify(revision.to_json())
+    return jsonify(revision_serializer.get_or_404(id))
 
 
 @api.route('/machines/<int:id>/revisions/')
+@conditional('machines', 'revisions', weak=True)
+@cached('machine:{id}:revisions')
 def get_machine_revisions(id):
-    machine = Machine.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = machine.revisions.order_by(Revision.timestamp.asc()).paginate(
-        page, per_page=current_app.config['RIVALROCKETS_REVISIONS_PER_PAGE'],
-        error_out=False)
-    revisions = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_revisions', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_revisions', page=page+1, _external=True)
+    Machine.query.get_or_404(id)
+    page = paginate(
+        revision_serializer.query().filter(Revision.machine_id == id).
+        order_by(Revision.timestamp.asc()), Revision,
+        'api.get_machine_revisions',
+        per_page=current_app.config['RIVALROCKETS_REVISIONS_PER_PAGE'],
+        descending=False, id=id)
     return jsonify({
-        'machines': [revision.to_json() for revision in revisions],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
+        'machines': revision_serializer.dump_all(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
     })
 
 
 @api.route('/machines/<int:id>/revisions/', methods=['POST'])
 @permission_required(Permission.CREATE_MACHINE_DATA)
 def new_machine_revision(id):
-    import pdb; pdb.set_trace()
-
     machine = Machine.query.get_or_404(id)
     revision = Revision.from_json(request.json)
     revision.author = g.current_user
     revision.machine = machine
     db.session.add(revision)
     db.session.commit()
+    response_cache.invalidate('revisions', 'machines', 'machine:%d' % id,
+                              'machine:%d:revisions' % id,
+                              'user:%s:machines' % machine.author_id)
     return jsonify(revision.to_json()), 201, \
            {'Location': url_for('api.get_revision', id=revision.id, _external=True)}
 
@@ -77,8 +130,12 @@ def edit_revision(id):
     if g.current_user != revision.author and \
             not g.current_user.can(Permission.ADMINISTER):
         return forbidden('Insufficient permissions')
-    revision.system_name = request.json.get('system_name', revision.system_name)
-    revision.system_notes = request.json.get('system_notes', revision.system_notes)
+    for field in Revision.EDITABLE_FIELDS:
+        setattr(revision, field,
+                request.json.get(field, getattr(revision, field)))
     db.session.add(revision)
+    db.session.commit()
+    response_cache.invalidate('revisions', 'revision:%d' % id,
+                              'machine:%s:revisions' % revision.machine_id)
     return jsonify(revision.to_json())
 
@@ -0,0 +1,57 @@
+import hashlib
+from flask import request, current_app
+from itsdangerous import TimestampSigner, BadSignature
+from .. import db, response_cache
+from . import api
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# clients that wrote recently read from the primary until the replicas
+# have had time to catch up. Clients keeping cookies carry the marker
+# themselves; for the others it lives in the response cache backend,
+# which every worker sees when it is the shared one.
+WRITE_COOKIE = 'rivalrockets_wrote'
+
+
+def client_key():
+    credentials = request.headers.get('Authorization') or \
+        request.remote_addr or ''
+    return hashlib.sha1(credentials.encode('utf-8')).hexdigest()
+
+
+def signer():
+    return TimestampSigner(current_app.config['SECRET_KEY'],
+                           salt='read-after-write')
+
+
+def recently_wrote(key):
+    window = current_app.config['RIVALROCKETS_READ_AFTER_WRITE_SECONDS']
+    token = request.cookies.get(WRITE_COOKIE)
+    if token:
+        try:
+            if signer().unsign(token, max_age=window).decode('utf-8') == key:
+                return True
+        except BadSignature:
+            pass
+    return response_cache.has_flag('wrote:' + key)
+
+
+@api.before_request
+def route_reads():
+    if request.method in SAFE_METHODS and \
+            current_app.config['RIVALROCKETS_DATABASE_REPLICAS'] and \
+            not recently_wrote(client_key()):
+        db.use_replica()
+
+
+@api.after_request
+def remember_writes(response):
+    if request.method not in SAFE_METHODS and response.status_code < 400 \
+            and current_app.config['RIVALROCKETS_DATABASE_REPLICAS']:
+        key = client_key()
+        window = current_app.config['RIVALROCKETS_READ_AFTER_WRITE_SECONDS']
+        response_cache.set_flag('wrote:' + key, window)
+        response.set_cookie(WRITE_COOKIE, signer().sign(key).decode('utf-8'),
+                            max_age=window, httponly=True,
+                            secure=request.is_secure)
+    return response
@@ -0,0 +1,50 @@
+from flask import request, current_app, url_for
+from .. import db, fulltext_index
+from ..exceptions import ValidationError
+from . import api
+from .encoding import jsonify
+from .serializers import url_template
+
+KIND_ENDPOINTS = {
+    'machine': 'api.get_machine',
+    'revision': 'api.get_revision',
+    'comment': 'api.get_comment',
+}
+
+
+@api.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        raise ValidationError('search does not have a query')
+    kind = request.args.get('kind')
+    if kind is not None and kind not in KIND_ENDPOINTS:
+        raise ValidationError('kind must be machine, revision or comment')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['RIVALROCKETS_SEARCH_RESULTS_PER_PAGE']
+    rows = fulltext_index.search(db.session.connection(), query, kind,
+                                 offset=(page - 1) * per_page,
+                                 limit=per_page + 1)
+    results = []
+    for kind_, ref_id, snippet, rank in rows[:per_page]:
+        template = url_template(KIND_ENDPOINTS[kind_])
+        results.append({
+            'kind': kind_,
+            'url': template[0] + str(ref_id) + template[1],
+            'snippet': snippet,
+            'rank': rank
+        })
+    args = request.args.to_dict()
+    prev = None
+    if page > 1:
+        args['page'] = page - 1
+        prev = url_for('api.search', _external=True, **args)
+    next = None
+    if len(rows) > per_page:
+        args['page'] = page + 1
+        next = url_for('api.search', _external=True, **args)
+    return jsonify({
+        'results': results,
+        'prev': prev,
+        'next': next
+    })
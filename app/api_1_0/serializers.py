@@ -0,0 +1,295 @@
+from collections import namedtuple
+from flask import g, url_for, abort, request
+from sqlalchemy import and_, func
+from .. import db
+from ..exceptions import ValidationError
+from ..models import User, Machine, Comment, Revision
+
+# Placeholder id used to render an endpoint once per request; the resulting
+# URL is split around it so row URLs are built by plain concatenation.
+URL_SENTINEL = 2147483647
+
+
+def url_template(endpoint):
+    templates = getattr(g, 'url_templates', None)
+    if templates is None:
+        templates = g.url_templates = {}
+    template = templates.get(endpoint)
+    if template is None:
+        url = url_for(endpoint, id=URL_SENTINEL, _external=True)
+        template = templates[endpoint] = tuple(url.split(str(URL_SENTINEL), 1))
+    return template
+
+
+def requested(name):
+    """Return the comma separated values of query argument ``name``."""
+    values = []
+    for value in request.args.getlist(name):
+        values.extend(item.strip() for item in value.split(',')
+                      if item.strip())
+    return values
+
+
+class Relation(object):
+    """A related resource that ``?expand=`` can embed.
+
+    Rows are matched on ``local`` (an attribute of the parent serializer)
+    and ``remote`` (an attribute of ``serializer``). Each relation costs
+    one ``IN`` query for the whole page, however many parents it holds.
+    """
+
+    def __init__(self, serializer, local, remote='id', many=False,
+                 latest=False):
+        self.serializer = serializer
+        self.local = local
+        self.remote = remote
+        self.many = many
+        self.latest = latest
+
+    @property
+    def table(self):
+        return self.serializer.model.__tablename__
+
+    def load(self, name, keys):
+        serializer = self.serializer
+        model = serializer.model
+        remote = getattr(model, self.remote)
+        view = serializer.view(requested('fields[%s]' % name) or None,
+                               required=(self.remote,))
+        query = serializer.query(view).filter(remote.in_(keys))
+        if self.latest:
+            newest = db.session.query(
+                remote.label('key'),
+                func.max(model.timestamp).label('timestamp')).\
+                filter(remote.in_(keys)).group_by(remote).subquery()
+            query = query.join(newest, and_(
+                remote == newest.c.key, model.timestamp == newest.c.timestamp))
+        if self.many or self.latest:
+            query = query.order_by(model.timestamp.asc(), model.id.asc())
+        plan = serializer.plan(view)
+        index = view.attributes.index(self.remote)
+        loaded = {}
+        for row in query:
+            obj = serializer.dump(row, plan)
+            if self.many:
+                loaded.setdefault(row[index], []).append(obj)
+            else:
+                # with ``latest`` a later row wins timestamp ties
+                loaded[row[index]] = obj
+        return loaded
+
+
+View = namedtuple('View', 'attributes fields')
+
+
+class Serializer(object):
+    """Read-only counterpart of the models' ``to_json`` methods.
+
+    Only the columns a resource needs are selected, rows come back as plain
+    tuples that never enter the session's identity map, and URL fields are
+    rendered from per-request templates instead of ``url_for`` calls.
+    A ``fields`` query argument narrows both the keys that are rendered and
+    the columns that are selected.
+    """
+
+    # selected whatever the fieldset, pagination and lookups key on them
+    KEY_ATTRIBUTES = ('id', 'timestamp')
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.keys = [key for key, attribute, endpoint in fields]
+        self.relations = {}
+        self.attributes = []
+        for key, attribute, endpoint in fields:
+            if attribute not in self.attributes:
+                self.attributes.append(attribute)
+        for attribute in self.KEY_ATTRIBUTES:
+            if attribute not in self.attributes and hasattr(model, attribute):
+                self.attributes.append(attribute)
+
+    def view(self, keys=None, required=()):
+        """Return the attributes to select and the fields to render.
+
+        ``keys`` limits the rendered fields (all of them when None) and
+        ``required`` names attributes selected even when not rendered.
+        """
+        if keys is None:
+            fields = self.fields
+        else:
+            for key in keys:
+                if key not in self.keys:
+                    raise ValidationError(
+                        'unknown field %s, expected one of %s' %
+                        (key, ', '.join(self.keys)))
+            fields = [field for field in self.fields if field[0] in keys]
+        needed = set(attribute for key, attribute, endpoint in fields)
+        needed.update(self.KEY_ATTRIBUTES)
+        needed.update(required)
+        return View([attribute for attribute in self.attributes
+                     if attribute in needed], fields)
+
+    def current(self):
+        """Return the view selected by the request's ``fields`` argument."""
+        views = getattr(g, 'serializer_views', None)
+        if views is None:
+            views = g.serializer_views = {}
+        view = views.get(self.model)
+        if view is None:
+            view = views[self.model] = self.view(
+                requested('fields') or None,
+                required=[relation.local for name, relation
+                          in self.expansions()])
+        return view
+
+    def columns(self, view=None):
+        if view is None:
+            view = self.current()
+        return [getattr(self.model, attribute)
+                for attribute in view.attributes]
+
+    def query(self, view=None):
+        return self.model.query.with_entities(*self.columns(view))
+
+    def select(self, view=None):
+        return db.select(self.columns(view))
+
+    def get_or_404(self, id):
+        row = self.query().filter(self.model.id == id).first()
+        if row is None:
+            abort(404)
+        return self.dump_all([row])[0]
+
+    def expansions(self):
+        """Return the relations named by the request's ``expand`` argument."""
+        names = requested('expand')
+        for name in names:
+            if name not in self.relations:
+                raise ValidationError('cannot expand %s, expected one of %s' %
+                                      (name, ', '.join(sorted(self.relations))))
+        return [(name, self.relations[name]) for name in names]
+
+    def expand(self, objs, rows, view, expansions):
+        for name, relation in expansions:
+            index = view.attributes.index(relation.local)
+            keys = set(row[index] for row in rows if row[index] is not None)
+            loaded = relation.load(name, keys) if keys else {}
+            default = [] if relation.many else None
+            for obj, row in zip(objs, rows):
+                obj[name] = loaded.get(row[index], default)
+
+    def plan(self, view=None):
+        if view is None:
+            view = self.current()
+        return [(key, view.attributes.index(attribute),
+                 url_template(endpoint) if endpoint else None)
+                for key, attribute, endpoint in view.fields]
+
+    def dump(self, row, plan=None):
+        if plan is None:
+            plan = self.plan()
+        obj = {}
+        for key, index, template in plan:
+            value = row[index]
+            if template is not None and value is not None:
+                value = template[0] + str(value) + template[1]
+            obj[key] = value
+        return obj
+
+    def dump_all(self, rows):
+        view = self.current()
+        plan = self.plan(view)
+        objs = [self.dump(row, plan) for row in rows]
+        if objs:
+            self.expand(objs, rows, view, self.expansions())
+        return objs
+
+
+user_serializer = Serializer(User, (
+    ('url', 'id', 'api.get_machine'),
+    ('username', 'username', None),
+    ('member_since', 'member_since', None),
+    ('last_seen', 'last_seen', None),
+    ('machines', 'id', 'api.get_user_machines'),
+    ('machine_count', 'machine_count', None),
+))
+
+machine_serializer = Serializer(Machine, (
+    ('url', 'id', 'api.get_machine'),
+    ('system_name', 'system_name', None),
+    ('system_notes', 'system_notes', None),
+    ('system_notes_html', 'system_notes_html', None),
+    ('timestamp', 'timestamp', None),
+    ('owner', 'owner', None),
+    ('author', 'author_id', 'api.get_user'),
+    ('revisions', 'id', 'api.get_machine_revisions'),
+    ('revision_count', 'revision_count', None),
+    ('comments', 'id', 'api.get_machine_comments'),
+    ('comment_count', 'comment_count', None),
+))
+
+comment_serializer = Serializer(Comment, (
+    ('url', 'id', 'api.get_comment'),
+    ('machine', 'machine_id', 'api.get_machine'),
+    ('body', 'body', None),
+    ('body_html', 'body_html', None),
+    ('timestamp', 'timestamp', None),
+    ('author', 'author_id', 'api.get_user'),
+))
+
+revision_serializer = Serializer(Revision, (
+    ('url', 'id', 'api.get_revision'),
+    ('machine', 'machine_id', 'api.get_machine'),
+    ('cpu_make', 'cpu_make', None),
+    ('cpu_name', 'cpu_name', None),
+    ('cpu_socket', 'cpu_socket', None),
+    ('cpu_mhz', 'cpu_mhz', None),
+    ('cpu_proc_cores', 'cpu_proc_cores', None),
+    ('chipset', 'chipset', None),
+    ('system_memory_mb', 'system_memory_mb', None),
+    ('system_memory_mhz', 'system_memory_mhz', None),
+    ('gpu_name', 'gpu_name', None),
+    ('gpu_make', 'gpu_make', None),
+    ('gpu_memory_mb', 'gpu_memory_mb', None),
+    ('revision_notes', 'revision_notes', None),
+    ('revision_notes_html', 'revision_notes_html', None),
+    ('pcpartpicker_url', 'pcpartpicker_url', None),
+    ('timestamp', 'timestamp', None),
+    ('author', 'author_id', 'api.get_user'),
+))
+
+
+user_serializer.relations = {
+    'machines': Relation(machine_serializer, 'id', 'author_id', many=True),
+}
+
+machine_serializer.relations = {
+    'author': Relation(user_serializer, 'author_id'),
+    'revisions': Relation(revision_serializer, 'id', 'machine_id', many=True),
+    'latest_revision': Relation(revision_serializer, 'id', 'machine_id',
+                                latest=True),
+    'comments': Relation(comment_serializer, 'id', 'machine_id', many=True),
+}
+
+comment_serializer.relations = {
+    'author': Relation(user_serializer, 'author_id'),
+    'machine': Relation(machine_serializer, 'machine_id'),
+}
+
+revision_serializer.relations = {
+    'author': Relation(user_serializer, 'author_id'),
+    'machine': Relation(machine_serializer, 'machine_id'),
+}
+
+
+def expanded_tables():
+    """Tables read by the relations the current request expands."""
+    tables = set()
+    names = requested('expand')
+    if names:
+        for serializer in (user_serializer, machine_serializer,
+                           comment_serializer, revision_serializer):
+            for name in names:
+                if name in serializer.relations:
+                    tables.add(serializer.relations[name].table)
+    return tuple(sorted(tables))
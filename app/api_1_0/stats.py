@@ -0,0 +1,32 @@
+from flask import request, url_for, abort
+from ..models import HardwareRollup
+from . import api
+from .encoding import jsonify
+from .decorators import conditional, cached
+
+
+@api.route('/stats/')
+def get_stats():
+    return jsonify({
+        'dimensions': dict(
+            (dimension, url_for('api.get_dimension_stats',
+                                dimension=dimension, _external=True))
+            for dimension in ('month',) + HardwareRollup.DIMENSIONS)
+    })
+
+
+@api.route('/stats/<dimension>')
+@conditional('revisions', 'hardware_rollups', weak=True)
+@cached('revisions', 'hardware_rollups')
+def get_dimension_stats(dimension):
+    if dimension != 'month' and dimension not in HardwareRollup.DIMENSIONS:
+        abort(404)
+    month = request.args.get('month', HardwareRollup.ALL_MONTHS)
+    rollups = HardwareRollup.query.filter_by(
+        dimension=dimension, month=month).filter(
+        HardwareRollup.revision_count > 0).order_by(
+        HardwareRollup.revision_count.desc(), HardwareRollup.value).all()
+    return jsonify({
+        'dimension': dimension,
+        'stats': [rollup.to_json() for rollup in rollups]
+    })
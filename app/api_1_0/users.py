@@ -1,31 +1,31 @@
-from flask import jsonify, request, current_app, url_for
+from flask import request, current_app, url_for
 from . import api
+from .encoding import jsonify
 from ..models import User, Machine
+from .decorators import conditional, cached
+from .pagination import paginate
+from .serializers import user_serializer, machine_serializer
 
 
 @api.route('/users/<int:id>')
+@conditional('users')
+@cached('user:{id}')
 def get_user(id):
-    user = User.query.get_or_404(id)
-    return jsonify(user.to_json())
+    return jsonify(user_serializer.get_or_404(id))
 
 
 @api.route('/users/<int:id>/machines/')
+@conditional('users', 'machines', weak=True)
+@cached('user:{id}:machines')
 def get_user_machines(id):
-    user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.machines.order_by(Machine.timestamp.desc()).paginate(
-        page, per_page=current_app.config['RIVALROCKETS_MACHINES_PER_PAGE'],
-        error_out=False)
-    machines = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_machines', page=page-1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_machines', page=page+1, _external=True)
+    User.query.get_or_404(id)
+    page = paginate(
+        machine_serializer.query().filter(Machine.author_id == id).
+        order_by(Machine.timestamp.desc()), Machine, 'api.get_user_machines',
+        per_page=current_app.config['RIVALROCKETS_MACHINES_PER_PAGE'], id=id)
     return jsonify({
-        'machines': [machine.to_json() for machine in machines],
-        'prev': prev,
-        'next': next,
-        'count': pagination.total
+        'machines': machine_serializer.dump_all(page.items),
+        'prev': page.prev,
+        'next': page.next,
+        'count': page.count
     })
@@ -0,0 +1,253 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe LRU mapping with per-entry TTLs.
+
+    The cache is bounded by entry count, by the sum of the sizes given to
+    ``set`` (a byte budget when callers pass ``len(value)``), or both.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, default_ttl=None,
+                 on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.on_evict = on_evict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] is None or entry[0] > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[2]
+                self._remove(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, size=1):
+        if ttl is None:
+            ttl = self.default_ttl
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            expires = time.time() + ttl if ttl is not None else None
+            self._data[key] = (expires, size, value)
+            self.size += size
+            while (self.max_entries is not None and
+                   len(self._data) > self.max_entries) or \
+                    (self.max_bytes is not None and self.size > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._remove(key)
+
+    def _remove(self, key):
+        expires, size, value = self._data.pop(key)
+        self.size -= size
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+
+class LocalBackend(object):
+    """Per-process response store with a byte budget."""
+
+    def __init__(self, max_bytes):
+        self.tags = {}
+        self.entries = LRUCache(max_bytes=max_bytes, on_evict=self._untag)
+        self.flags = LRUCache(max_entries=10000)
+        # taken before the entries' own lock, whose evictions call _untag,
+        # so the two are always acquired in the same order
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl, tags):
+        with self._lock:
+            self.entries.set(key, (tags, value), ttl=ttl, size=len(value[2]))
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self.tags.pop(tag, ())):
+                    self.entries.delete(key)
+
+    def set_flag(self, name, ttl):
+        self.flags.set(name, True, ttl=ttl)
+
+    def has_flag(self, name):
+        return self.flags.get(name) is not None
+
+    def _untag(self, key, entry):
+        with self._lock:
+            for tag in entry[0]:
+                keys = self.tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.tags[tag]
+
+
+class SharedBackend(object):
+    """Response store kept in a Redis-compatible server.
+
+    Every worker sees the same entries and invalidations. Each tag is a set
+    holding the keys of the responses that depend on it.
+    """
+
+    def __init__(self, client, prefix='rivalrockets:api:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl, tags):
+        self.client.setex(self.prefix + key, ttl, pickle.dumps(value))
+        for tag in tags:
+            self.client.sadd(self.prefix + 'tag:' + tag, key)
+
+    def invalidate(self, tags):
+        names = []
+        for tag in tags:
+            name = self.prefix + 'tag:' + tag
+            names.append(name)
+            names.extend(self.prefix + key.decode('utf-8')
+                         if isinstance(key, bytes) else self.prefix + key
+                         for key in self.client.smembers(name))
+        if names:
+            self.client.delete(*names)
+
+    def set_flag(self, name, ttl):
+        self.client.setex(self.prefix + 'flag:' + name, ttl, b'1')
+
+    def has_flag(self, name):
+        return self.client.get(self.prefix + 'flag:' + name) is not None
+
+
+class LocalSharedClient(object):
+    """In-process stand-in for the subset of the Redis API used above."""
+
+    def __init__(self):
+        self.values = {}
+        self.sets = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            entry = self.values.get(name)
+            if entry is None or entry[0] <= time.time():
+                return None
+            return entry[1]
+
+    def setex(self, name, time_, value):
+        with self._lock:
+            self.values[name] = (time.time() + time_, value)
+
+    def sadd(self, name, *values):
+        with self._lock:
+            self.sets.setdefault(name, set()).update(values)
+
+    def smembers(self, name):
+        with self._lock:
+            return set(self.sets.get(name, ()))
+
+    def delete(self, *names):
+        with self._lock:
+            for name in names:
+                self.values.pop(name, None)
+                self.sets.pop(name, None)
+
+
+class ResponseCache(object):
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttls = {}
+        self.default_ttl = 0
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config['RIVALROCKETS_API_CACHE_BACKEND']
+        if kind == 'local':
+            self.backend = LocalBackend(
+                app.config['RIVALROCKETS_API_CACHE_MAX_BYTES'])
+        elif kind == 'shared':
+            url = app.config['RIVALROCKETS_API_CACHE_URL']
+            if url:
+                import redis
+                client = redis.StrictRedis.from_url(url)
+            else:
+                client = LocalSharedClient()
+            self.backend = SharedBackend(client)
+        else:
+            self.backend = None
+        self.ttls = app.config['RIVALROCKETS_API_CACHE_TTLS']
+        self.default_ttl = app.config['RIVALROCKETS_API_CACHE_DEFAULT_TTL']
+
+    def ttl_for(self, endpoint):
+        return self.ttls.get(endpoint, self.default_ttl)
+
+    @staticmethod
+    def make_key(endpoint, url, scope):
+        return hashlib.sha1(
+            ('%s|%s|%s' % (endpoint, url, scope)).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl, tags):
+        if self.backend is not None and ttl > 0:
+            self.backend.set(key, value, ttl, tags)
+
+    def invalidate(self, *tags):
+        if self.backend is not None and tags:
+            self.backend.invalidate(tags)
+
+    def set_flag(self, name, ttl):
+        """Remember ``name`` for ``ttl`` seconds, in every worker if shared."""
+        if self.backend is not None:
+            self.backend.set_flag(name, int(ttl))
+
+    def has_flag(self, name):
+        return self.backend is not None and self.backend.has_flag(name)
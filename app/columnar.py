@@ -0,0 +1,142 @@
+import csv
+import io
+from array import array
+from sqlalchemy import select
+from .models import Revision
+
+NUMERIC_COLUMNS = ('id', 'machine_id', 'cpu_mhz', 'cpu_proc_cores',
+                   'system_memory_mb', 'gpu_memory_mb')
+CATEGORICAL_COLUMNS = ('cpu_make', 'cpu_name', 'gpu_make', 'gpu_name')
+COLUMNS = NUMERIC_COLUMNS + CATEGORICAL_COLUMNS
+FORMATS = ('csv', 'npz', 'arrow')
+MIMETYPES = {
+    'csv': 'text/csv',
+    'npz': 'application/octet-stream',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# stands in for NULL in numeric columns and dictionary codes
+MISSING = -1
+
+
+def require_format(format):
+    """Import the optional libraries ``format`` depends on."""
+    if format == 'npz':
+        import numpy
+    if format == 'arrow':
+        import pyarrow
+
+
+def revision_chunks(connection, batch_size):
+    table = Revision.__table__
+    result = connection.execution_options(stream_results=True).execute(
+        select([table.c[name] for name in COLUMNS]).order_by(table.c.id))
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+class ColumnarRevisions(object):
+    """Revision hardware specs accumulated column by column.
+
+    Numeric columns are packed into ``array('q')`` buffers with ``MISSING``
+    for NULL; string columns are dictionary encoded into ``array('i')``
+    codes plus a list of distinct values.
+    """
+
+    def __init__(self):
+        self.numeric = dict((name, array('q')) for name in NUMERIC_COLUMNS)
+        self.codes = dict((name, array('i')) for name in CATEGORICAL_COLUMNS)
+        self.dictionaries = dict((name, []) for name in CATEGORICAL_COLUMNS)
+        self._lookup = dict((name, {}) for name in CATEGORICAL_COLUMNS)
+
+    def __len__(self):
+        return len(self.numeric['id'])
+
+    def extend(self, rows):
+        for index, name in enumerate(NUMERIC_COLUMNS):
+            self.numeric[name].extend(MISSING if row[index] is None
+                                      else row[index] for row in rows)
+        for index, name in enumerate(CATEGORICAL_COLUMNS,
+                                     len(NUMERIC_COLUMNS)):
+            codes = self.codes[name]
+            lookup = self._lookup[name]
+            dictionary = self.dictionaries[name]
+            for row in rows:
+                value = row[index]
+                if value is None:
+                    codes.append(MISSING)
+                    continue
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(dictionary)
+                    dictionary.append(value)
+                codes.append(code)
+
+    def to_npz(self, fileobj):
+        import numpy as np
+        arrays = {}
+        for name in NUMERIC_COLUMNS:
+            arrays[name] = np.frombuffer(self.numeric[name], dtype=np.int64)
+        for name in CATEGORICAL_COLUMNS:
+            arrays[name] = np.frombuffer(self.codes[name], dtype=np.int32)
+            arrays[name + '_dictionary'] = np.array(self.dictionaries[name],
+                                                    dtype=np.str_)
+        np.savez_compressed(fileobj, **arrays)
+
+
+def csv_chunks(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def arrow_chunks(chunks):
+    """Encode ``chunks`` as an Arrow IPC stream, one record batch each.
+
+    Strings are written as they are rather than dictionary encoded, as
+    every batch would need a dictionary of its own and the stream has a
+    single schema.
+    """
+    import pyarrow as pa
+    types = [pa.int64()] * len(NUMERIC_COLUMNS) + \
+        [pa.string()] * len(CATEGORICAL_COLUMNS)
+    schema = pa.schema([pa.field(name, type_)
+                        for name, type_ in zip(COLUMNS, types)])
+    buffer = io.BytesIO()
+    writer = pa.RecordBatchStreamWriter(buffer, schema)
+    for rows in chunks:
+        writer.write_batch(pa.RecordBatch.from_arrays(
+            [pa.array(list(values), type=type_)
+             for values, type_ in zip(zip(*rows), types)], list(COLUMNS)))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    writer.close()
+    yield buffer.getvalue()
+
+
+def write_revisions(connection, format, fileobj, batch_size=10000):
+    """Write the revision specs to a binary ``fileobj`` in ``format``."""
+    chunks = revision_chunks(connection, batch_size)
+    if format == 'csv':
+        for text in csv_chunks(chunks):
+            fileobj.write(text.encode('utf-8'))
+    elif format == 'arrow':
+        for data in arrow_chunks(chunks):
+            fileobj.write(data)
+    elif format == 'npz':
+        columns = ColumnarRevisions()
+        for rows in chunks:
+            columns.extend(rows)
+        columns.to_npz(fileobj)
+    else:
+        raise ValueError('unknown format %r' % format)
@@ -1,12 +1,6 @@
-from threading import Thread
 from flask import current_app, render_template
 from flask_mail import Message
-from . import mail
-
-
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+from . import mail_outbox
 
 
 def send_email(to, subject, template, **kwargs):
@@ -15,6 +9,4 @@ def send_email(to, subject, template, **kwargs):
                   sender=app.config['RIVALROCKETS_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    return mail_outbox.send(msg)
@@ -1,2 +1,10 @@
 class ValidationError(ValueError):
     pass
+
+
+class ServiceUnavailable(RuntimeError):
+    pass
+
+
+class NotAcceptable(ValueError):
+    pass
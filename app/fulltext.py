@@ -0,0 +1,203 @@
+from markupsafe import escape
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+TABLE = 'search_documents'
+
+CREATE_TABLE = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5("
+        "kind UNINDEXED, ref_id UNINDEXED, body, tokenize = 'porter')",
+    ],
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS search_documents ("
+        "kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL, body TEXT, "
+        "body_tsv TSVECTOR, PRIMARY KEY (kind, ref_id))",
+        "CREATE INDEX IF NOT EXISTS ix_search_documents_body_tsv "
+        "ON search_documents USING GIN (body_tsv)",
+    ],
+}
+
+INSERT = {
+    'sqlite': "INSERT INTO search_documents (rowid, kind, ref_id, body) "
+              "VALUES (:rowid, :kind, :ref_id, :body)",
+    'postgresql': "INSERT INTO search_documents (kind, ref_id, body, body_tsv) "
+                  "VALUES (:kind, :ref_id, :body, "
+                  "to_tsvector('english', coalesce(:body, '')))",
+}
+
+# FTS5 cannot index kind and ref_id, so SQLite documents live at a rowid
+# derived from them and are deleted through it
+DELETE = {
+    'sqlite': "DELETE FROM search_documents WHERE rowid = :rowid",
+    'postgresql': "DELETE FROM search_documents "
+                  "WHERE kind = :kind AND ref_id = :ref_id",
+}
+
+KINDS = ('machine', 'revision', 'comment')
+
+# private use characters the database marks matches with; the snippet is
+# escaped before they are turned into <mark> tags
+START = '\ue000'
+STOP = '\ue001'
+
+SEARCH = {
+    'sqlite': "SELECT kind, ref_id, "
+              "snippet(search_documents, 2, :start, :stop, '...', 16) "
+              "AS snippet, bm25(search_documents) AS score "
+              "FROM search_documents WHERE search_documents MATCH :query "
+              "{kind} ORDER BY score LIMIT :limit OFFSET :offset",
+    'postgresql': "SELECT kind, ref_id, "
+                  "ts_headline('english', body, q, :options) "
+                  "AS snippet, ts_rank(body_tsv, q) AS score "
+                  "FROM search_documents, "
+                  "plainto_tsquery('english', :query) AS q "
+                  "WHERE body_tsv @@ q {kind} "
+                  "ORDER BY score DESC LIMIT :limit OFFSET :offset",
+}
+
+
+def highlight(snippet):
+    """Escape ``snippet`` as HTML, then mark up the matched terms."""
+    if snippet is None:
+        return None
+    return str(escape(snippet)).replace(START, '<mark>').\
+        replace(STOP, '</mark>')
+
+
+def document(kind, ref_id, body=None):
+    return {'rowid': ref_id * len(KINDS) + KINDS.index(kind), 'kind': kind,
+            'ref_id': ref_id, 'body': body}
+
+
+def sqlite_query(query):
+    # quote every term so user input cannot inject FTS5 query syntax
+    return ' '.join('"%s"' % term.replace('"', '""')
+                    for term in query.split())
+
+
+class FullTextIndex(object):
+    """Keeps ``search_documents`` in sync with the free-text columns.
+
+    SQLite databases use an FTS5 virtual table and Postgres databases a
+    ``tsvector`` column with a GIN index. Other databases, and SQLite
+    builds without FTS5, simply get no search.
+    """
+
+    def __init__(self):
+        self.available = {}
+
+    @staticmethod
+    def documents():
+        from .models import Machine, Revision, Comment
+        return (
+            ('machine', Machine, ('system_name', 'system_notes')),
+            ('revision', Revision, ('revision_notes',)),
+            ('comment', Comment, ('body',)),
+        )
+
+    @staticmethod
+    def body(values):
+        return '\n'.join(value for value in values if value).\
+            replace(START, '').replace(STOP, '')
+
+    def create_table(self, target, connection, **kwargs):
+        for statement in CREATE_TABLE.get(connection.dialect.name, ()):
+            try:
+                connection.execute(text(statement))
+            except DBAPIError:
+                return
+        self.available.pop(str(connection.engine.url), None)
+
+    def is_available(self, connection):
+        key = str(connection.engine.url)
+        if key not in self.available:
+            self.available[key] = \
+                connection.dialect.name in CREATE_TABLE and \
+                connection.dialect.has_table(connection, TABLE)
+        return self.available[key]
+
+    def write(self, connection, kind, ref_id, body):
+        dialect = connection.dialect.name
+        connection.execute(text(DELETE[dialect]), **document(kind, ref_id))
+        if body:
+            connection.execute(text(INSERT[dialect]),
+                               **document(kind, ref_id, body))
+
+    def write_many(self, connection, kind, documents):
+        """Replace the documents of ``(ref_id, body)`` pairs in bulk."""
+        if not documents or not self.is_available(connection):
+            return
+        dialect = connection.dialect.name
+        connection.execute(text(DELETE[dialect]),
+                           [document(kind, ref_id)
+                            for ref_id, body in documents])
+        documents = [document(kind, ref_id, body)
+                     for ref_id, body in documents if body]
+        if documents:
+            connection.execute(text(INSERT[dialect]), documents)
+
+    def sync(self, session, flush_context):
+        connection = session.connection()
+        if not self.is_available(connection):
+            return
+        for kind, model, columns in self.documents():
+            for instance in session.new | session.dirty:
+                if not isinstance(instance, model):
+                    continue
+                if instance not in session.new:
+                    attrs = inspect(instance).attrs
+                    if not any(attrs[column].history.has_changes()
+                               for column in columns):
+                        continue
+                self.write(connection, kind, instance.id, self.body(
+                    getattr(instance, column) for column in columns))
+            for instance in session.deleted:
+                if isinstance(instance, model):
+                    connection.execute(
+                        text(DELETE[connection.dialect.name]),
+                        **document(kind, instance.id))
+
+    def search(self, connection, query, kind=None, offset=0, limit=20):
+        if not self.is_available(connection):
+            return []
+        dialect = connection.dialect.name
+        if dialect == 'sqlite':
+            query = sqlite_query(query)
+        params = {'query': query, 'limit': limit, 'offset': offset,
+                  'start': START, 'stop': STOP,
+                  'options': 'StartSel=%s, StopSel=%s, MaxFragments=2' %
+                             (START, STOP)}
+        condition = ''
+        if kind is not None:
+            condition = 'AND kind = :kind'
+            params['kind'] = kind
+        rows = connection.execute(
+            text(SEARCH[dialect].format(kind=condition)), **params).fetchall()
+        return [(kind_, ref_id, highlight(snippet), score)
+                for kind_, ref_id, snippet, score in rows]
+
+    def rebuild(self, connection, batch_size=1000):
+        """Re-index every document, yielding ``(kind, last id)`` per batch."""
+        if not self.is_available(connection):
+            return
+        connection.execute(text('DELETE FROM search_documents'))
+        insert = text(INSERT[connection.dialect.name])
+        for kind, model, columns in self.documents():
+            table = model.__table__
+            last_id = 0
+            while True:
+                rows = connection.execute(
+                    select([table.c.id] + [table.c[c] for c in columns]).
+                    where(table.c.id > last_id).
+                    order_by(table.c.id).limit(batch_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                documents = [document(kind, row[0], self.body(row[1:]))
+                             for row in rows]
+                documents = [document for document in documents
+                             if document['body']]
+                if documents:
+                    connection.execute(insert, documents)
+                yield kind, last_id
@@ -0,0 +1,298 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from sqlalchemy import select
+
+CATEGORICAL_COLUMNS = ('cpu_make', 'cpu_socket', 'chipset', 'gpu_make')
+NUMERIC_COLUMNS = ('cpu_mhz', 'cpu_proc_cores', 'system_memory_mb',
+                   'system_memory_mhz', 'gpu_memory_mb')
+COLUMNS = CATEGORICAL_COLUMNS + NUMERIC_COLUMNS
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def slots_of(bitmap):
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+def bitmap_of(slots, size):
+    """Build the bitmap with ``slots`` set in one pass over a byte buffer."""
+    buffer = bytearray((size + 7) // 8)
+    for slot in slots:
+        buffer[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bytes(buffer), 'little')
+
+
+class IndexState(object):
+    """The slots and bitmaps of one build of the index.
+
+    Every column keeps one bitmap per distinct value; numeric columns also
+    keep their distinct values sorted, so a range is a bisection and an OR
+    over the few values in it.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        self.ids = []
+        self.rows = []
+        self.live = 0
+        self.bitmaps = dict((name, {}) for name in COLUMNS)
+        self.values = dict((name, []) for name in NUMERIC_COLUMNS)
+
+    @classmethod
+    def load(cls, rows):
+        """Build a state from ``(id, values)`` pairs.
+
+        The slots of each value are collected first and turned into
+        bitmaps once at the end, as ORing bits into ever larger integers
+        one row at a time is quadratic.
+        """
+        state = cls()
+        members = dict((name, {}) for name in COLUMNS)
+        for id, values in rows:
+            slot = len(state.ids)
+            state.slots[id] = slot
+            state.ids.append(id)
+            state.rows.append(values)
+            for name, value in zip(COLUMNS, values):
+                if value is not None:
+                    members[name].setdefault(value, []).append(slot)
+        size = len(state.ids)
+        state.live = (1 << size) - 1
+        for name, groups in members.items():
+            state.bitmaps[name] = dict((value, bitmap_of(slots, size))
+                                       for value, slots in groups.items())
+        for name in NUMERIC_COLUMNS:
+            state.values[name] = sorted(state.bitmaps[name])
+        return state
+
+    def add(self, id, values):
+        slot = len(self.ids)
+        self.slots[id] = slot
+        self.ids.append(id)
+        self.rows.append(values)
+        bit = 1 << slot
+        self.live |= bit
+        for name, value in zip(COLUMNS, values):
+            if value is None:
+                continue
+            bitmaps = self.bitmaps[name]
+            if value not in bitmaps and name in self.values:
+                insort(self.values[name], value)
+            bitmaps[value] = bitmaps.get(value, 0) | bit
+
+    def remove(self, id):
+        slot = self.slots.pop(id, None)
+        if slot is None:
+            return
+        bit = 1 << slot
+        self.live &= ~bit
+        for name, value in zip(COLUMNS, self.rows[slot]):
+            if value is None:
+                continue
+            bitmaps = self.bitmaps[name]
+            bitmaps[value] &= ~bit
+            if not bitmaps[value]:
+                del bitmaps[value]
+                if name in self.values:
+                    values = self.values[name]
+                    del values[bisect_left(values, value)]
+        self.ids[slot] = None
+        self.rows[slot] = None
+
+    def range_bitmap(self, name, low=None, high=None):
+        values = self.values[name]
+        start = 0 if low is None else bisect_left(values, low)
+        end = len(values) if high is None else bisect_right(values, high)
+        bitmaps = self.bitmaps[name]
+        bitmap = 0
+        for value in values[start:end]:
+            bitmap |= bitmaps[value]
+        return bitmap
+
+
+class HardwareIndex(object):
+    """In-memory faceted index over the revision hardware specs.
+
+    Every revision occupies a slot and every column value has a bitmap (a
+    Python int) of the slots holding it, so a search is a handful of
+    bisections and big-integer ANDs rather than a table scan. Once built,
+    the index is rebuilt on a background thread when it goes stale, and
+    searches keep using the previous build until the new one is ready.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_age = None
+        self.built_at = None
+        self.stale = True
+        self.state = None
+        self._pending = None
+        self._building = False
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age = app.config['RIVALROCKETS_HARDWARE_INDEX_MAX_AGE']
+
+    def build(self, connection):
+        from .models import Revision
+        table = Revision.__table__
+        with self._lock:
+            # changes committed while we read are replayed onto the new build
+            self._pending = []
+            self.stale = False
+        try:
+            result = connection.execution_options(stream_results=True).\
+                execute(select([table.c.id] +
+                               [table.c[name] for name in COLUMNS]).
+                        order_by(table.c.id))
+            state = IndexState.load(self._rows(result))
+        except Exception:
+            with self._lock:
+                self._pending = None
+                self.stale = True
+            raise
+        with self._lock:
+            for id, values in self._pending:
+                state.remove(id)
+                if values is not None:
+                    state.add(id, values)
+            self._pending = None
+            self.state = state
+            self.built_at = time.time()
+
+    def _rows(self, result):
+        while True:
+            rows = result.fetchmany(10000)
+            if not rows:
+                break
+            for row in rows:
+                yield row[0], self.normalize(row[1:])
+
+    def _connect_and_build(self):
+        from . import db
+        connection = db.engine.connect()
+        try:
+            self.build(connection)
+        finally:
+            connection.close()
+
+    def ensure_built(self):
+        if self.state is None:
+            # nothing to serve yet, so the first build has to be waited for
+            with self._build_lock:
+                if self.state is None:
+                    self._connect_and_build()
+        elif self.stale or \
+                self.max_age and time.time() - self.built_at > self.max_age:
+            with self._lock:
+                if self._building:
+                    return
+                self._building = True
+            thread = threading.Thread(target=self._rebuild)
+            thread.daemon = True
+            thread.start()
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                self._connect_and_build()
+        except Exception:
+            self.app.logger.exception('Could not rebuild the hardware index')
+        finally:
+            self._building = False
+
+    @staticmethod
+    def normalize(values):
+        normalized = []
+        for name, value in zip(COLUMNS, values):
+            if value is not None and name in NUMERIC_COLUMNS:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    value = None
+            normalized.append(value)
+        return tuple(normalized)
+
+    def _change(self, id, values):
+        with self._lock:
+            if self.state is None:
+                return
+            self.state.remove(id)
+            if values is not None:
+                self.state.add(id, values)
+            if self._pending is not None:
+                self._pending.append((id, values))
+
+    def update(self, id, values):
+        self._change(id, self.normalize(values))
+
+    def remove(self, id):
+        self._change(id, None)
+
+    def search(self, equals=None, ranges=None, offset=0, limit=None):
+        """Return ``(ids, total, facets)`` for the revisions matching.
+
+        ``equals`` maps categorical columns to lists of accepted values and
+        ``ranges`` maps numeric columns to ``(low, high)`` bounds, either of
+        which may be None.
+        """
+        with self._lock:
+            state = self.state or IndexState()
+            result = state.live
+            for name, values in (equals or {}).items():
+                bitmaps = state.bitmaps[name]
+                accepted = 0
+                for value in values:
+                    accepted |= bitmaps.get(value, 0)
+                result &= accepted
+            for name, (low, high) in (ranges or {}).items():
+                result &= state.range_bitmap(name, low, high)
+            facets = {}
+            for name in CATEGORICAL_COLUMNS:
+                bitmaps = state.bitmaps[name]
+                counts = {}
+                for value, bitmap in bitmaps.items():
+                    count = popcount(bitmap & result)
+                    if count:
+                        counts[value] = count
+                facets[name] = counts
+            ids = []
+            for index, slot in enumerate(slots_of(result)):
+                if index < offset:
+                    continue
+                if limit is not None and len(ids) >= limit:
+                    break
+                ids.append(state.ids[slot])
+            return ids, popcount(result), facets
+
+    def collect(self, session, flush_context):
+        from .models import Revision
+        changes = session.info.setdefault('hardware_index', {})
+        for instance in session.new | session.dirty:
+            if isinstance(instance, Revision):
+                changes[instance.id] = tuple(getattr(instance, name)
+                                             for name in COLUMNS)
+        for instance in session.deleted:
+            if isinstance(instance, Revision):
+                changes[instance.id] = None
+
+    def apply(self, session):
+        changes = session.info.pop('hardware_index', None)
+        for id, values in (changes or {}).items():
+            if values is None:
+                self.remove(id)
+            else:
+                self.update(id, values)
+
+    def discard(self, session):
+        session.info.pop('hardware_index', None)
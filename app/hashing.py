@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from .exceptions import ServiceUnavailable
+
+
+class HashStats(object):
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rejected = 0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+
+class PasswordHasher(object):
+    """Runs PBKDF2 hashing on a bounded worker pool.
+
+    At most ``RIVALROCKETS_HASH_WORKERS + RIVALROCKETS_HASH_QUEUE_DEPTH``
+    operations may be pending; further requests fail fast with
+    ``ServiceUnavailable`` instead of piling up on the request threads.
+    """
+
+    def __init__(self, app=None):
+        self.mode = 'inline'
+        self.workers = 1
+        self.pending = None
+        self.stats = {'generate': HashStats(), 'check': HashStats()}
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.mode = app.config['RIVALROCKETS_HASH_POOL']
+        self.workers = app.config['RIVALROCKETS_HASH_WORKERS']
+        self.pending = threading.BoundedSemaphore(
+            self.workers + app.config['RIVALROCKETS_HASH_QUEUE_DEPTH'])
+
+    def metrics(self):
+        for operation, stats in sorted(self.stats.items()):
+            labels = (('operation', operation),)
+            yield ('counter', 'rivalrockets_password_hashes_total', labels,
+                   stats.count)
+            yield ('counter', 'rivalrockets_password_hash_seconds_total',
+                   labels, stats.seconds)
+            yield ('counter', 'rivalrockets_password_hashes_rejected_total',
+                   labels, stats.rejected)
+
+    @property
+    def executor(self):
+        # pools do not survive a fork, so each gunicorn worker builds its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    if self.mode == 'process':
+                        self._executor = ProcessPoolExecutor(self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def generate(self, password):
+        return self._run('generate', generate_password_hash, password)
+
+    def check(self, pwhash, password):
+        return self._run('check', check_password_hash, pwhash, password)
+
+    def _run(self, operation, f, *args):
+        stats = self.stats[operation]
+        start = time.time()
+        if self.mode == 'inline' or self.pending is None:
+            result = f(*args)
+        else:
+            if not self.pending.acquire(False):
+                with self._lock:
+                    stats.rejected += 1
+                raise ServiceUnavailable('Password hashing is saturated')
+            try:
+                future = self.executor.submit(f, *args)
+            except Exception:
+                self.pending.release()
+                raise
+            future.add_done_callback(lambda future: self.pending.release())
+            result = future.result()
+        elapsed = time.time() - start
+        with self._lock:
+            stats.observe(elapsed)
+        return result
@@ -0,0 +1,89 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import bindparam
+from sqlalchemy.orm.attributes import set_committed_value
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class LastSeenBuffer(object):
+    """Coalesces ``User.ping()`` calls into periodic batched UPDATEs.
+
+    Pings are recorded in memory with a resolution of
+    ``RIVALROCKETS_LAST_SEEN_RESOLUTION`` seconds and written out every
+    ``RIVALROCKETS_LAST_SEEN_FLUSH_INTERVAL`` seconds and at exit.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.pending = {}
+        self.resolution = 60
+        self.interval = 30
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.resolution = app.config['RIVALROCKETS_LAST_SEEN_RESOLUTION']
+        self.interval = app.config['RIVALROCKETS_LAST_SEEN_FLUSH_INTERVAL']
+
+    def bucket(self, when):
+        return int((when - EPOCH).total_seconds() // max(self.resolution, 1))
+
+    def record(self, user):
+        now = datetime.utcnow()
+        seen = self.pending.get(user.id) or user.last_seen
+        if seen is not None and seen >= now or \
+                seen is not None and self.bucket(seen) == self.bucket(now):
+            return
+        with self._lock:
+            self.pending[user.id] = now
+        # show the new value for the rest of the request without a flush
+        set_committed_value(user, 'last_seen', now)
+        self._start()
+
+    def _start(self):
+        # timer threads do not survive a fork, so start one per worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Could not flush last seen times')
+
+    def flush(self):
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        if not pending or self.app is None:
+            return
+        from . import db, response_cache
+        from .models import User, TableVersion
+        users = User.__table__
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(
+                    users.update().
+                    where(users.c.id == bindparam('user_id')).
+                    values(last_seen=bindparam('seen_at')),
+                    [{'user_id': user_id, 'seen_at': seen_at}
+                     for user_id, seen_at in pending.items()])
+                TableVersion.bump(connection, ['users'])
+            # responses that embed users are tagged with the table name
+            response_cache.invalidate('users')
@@ -0,0 +1,239 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, request
+
+ACCESS_LOGGER = 'rivalrockets.access'
+
+
+def fingerprint(record):
+    """Identify the code that logged ``record``, or raised its exception.
+
+    Unhandled exceptions are all logged from the same line in Flask, so
+    for those the innermost frame of the traceback is what counts.
+    """
+    parts = [record.name, record.levelname]
+    if record.exc_info and record.exc_info[0] is not None:
+        exc_type, exc, tb = record.exc_info
+        parts.append('%s.%s' % (exc_type.__module__, exc_type.__qualname__))
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        if tb is not None:
+            parts += [tb.tb_frame.f_code.co_filename, str(tb.tb_lineno)]
+    else:
+        parts += [record.pathname, str(record.lineno)]
+    return hashlib.sha1('\0'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, merged with the record's ``fields``."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat() +
+            'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, sort_keys=True)
+
+
+class ErrorDigestHandler(logging.Handler):
+    """Coalesces records by fingerprint and mails them out periodically.
+
+    ``target`` is the handler, usually an ``SMTPHandler``, that sends one
+    digest every ``interval`` seconds listing each distinct error once
+    with how often and when it happened.
+    """
+
+    def __init__(self, target, interval=300):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.interval = interval
+        self.pending = OrderedDict()
+        self.since = None
+        self._pid = None
+
+    def emit(self, record):
+        key = getattr(record, 'fingerprint', None) or fingerprint(record)
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                if not self.pending:
+                    self.since = record.created
+                self.pending[key] = [1, record.created, record.created,
+                                     self.format(record)]
+            else:
+                entry[0] += 1
+                entry[2] = record.created
+        self._start()
+
+    def _start(self):
+        # timer threads do not survive a fork, so start one per worker
+        if self._pid == os.getpid():
+            return
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    @staticmethod
+    def when(created):
+        return datetime.utcfromtimestamp(created).strftime(
+            '%Y-%m-%d %H:%M:%S UTC')
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+            since = self.since
+        if not pending:
+            return
+        lines = ['%d errors, %d distinct, since %s' % (
+            sum(entry[0] for entry in pending.values()), len(pending),
+            self.when(since))]
+        for key, (count, first, last, text) in pending.items():
+            lines += ['', '=' * 72,
+                      '[%s] %d times, first %s, last %s' % (
+                          key, count, self.when(first), self.when(last)),
+                      '', text]
+        self.target.handle(logging.makeLogRecord({
+            'name': 'rivalrockets.digest',
+            'levelno': logging.ERROR,
+            'levelname': 'ERROR',
+            'msg': '\n'.join(lines),
+        }))
+
+
+class PipelineHandler(QueueHandler):
+    """Hands records to the pipeline's queue, dropping them when full."""
+
+    def __init__(self, pipeline):
+        QueueHandler.__init__(self, pipeline.queue)
+        self.pipeline = pipeline
+
+    def prepare(self, record):
+        # the traceback is flattened into the message from here on
+        record.fingerprint = fingerprint(record)
+        return QueueHandler.prepare(self, record)
+
+    def emit(self, record):
+        self.pipeline.start()
+        QueueHandler.emit(self, record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.dropped += 1
+
+
+class PipelineListener(QueueListener):
+    def enqueue_sentinel(self):
+        # at exit it is fine to wait for room
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline(object):
+    """Moves the application's log I/O off the request threads.
+
+    The handlers ``app.logger`` had, and those given to ``add_handler``,
+    run on a listener thread fed through a queue holding at most
+    ``RIVALROCKETS_LOG_QUEUE_DEPTH`` records; records that do not fit are
+    dropped and counted. ``log_access`` adds one structured line per
+    request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue(app.config['RIVALROCKETS_LOG_QUEUE_DEPTH'])
+        self.handlers = list(app.logger.handlers)
+        self.handler = PipelineHandler(self)
+        self.listener = None
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        app.logger.handlers = [self.handler]
+        app.extensions['rivalrockets_log'] = self
+
+    @staticmethod
+    def of(app):
+        return app.extensions.get('rivalrockets_log') or LogPipeline(app)
+
+    def add_handler(self, handler):
+        """Add a handler; call before anything is logged."""
+        self.handlers.append(handler)
+
+    def metrics(self):
+        yield ('counter', 'rivalrockets_log_records_dropped_total', (),
+               self.dropped)
+        yield ('gauge', 'rivalrockets_log_queue_depth', (),
+               self.queue.qsize())
+
+    def start(self):
+        # the listener thread does not survive a fork, so start one per
+        # worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.listener = PipelineListener(self.queue, *self.handlers,
+                                             respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._pid == os.getpid():
+            self.listener.stop()
+
+    def log_access(self, handler):
+        """Log every request to ``handler`` as a line of JSON."""
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(logging.Filter(ACCESS_LOGGER))
+        self.add_handler(handler)
+        logger = logging.getLogger(ACCESS_LOGGER)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(self.handler)
+
+        @self.app.before_request
+        def start_timer():
+            g.access_started = time.perf_counter()
+
+        @self.app.after_request
+        def log_request(response):
+            started = g.pop('access_started', None)
+            logger.info('%s %s %s', request.method, request.path,
+                        response.status_code, extra={'fields': {
+                            'method': request.method,
+                            'path': request.path,
+                            'query': request.query_string.decode('latin-1'),
+                            'endpoint': request.endpoint,
+                            'status': response.status_code,
+                            'bytes': response.content_length,
+                            'ms': round((time.perf_counter() - started) *
+                                        1000, 3)
+                            if started is not None else None,
+                            'remote_addr': request.remote_addr,
+                            'user_agent': request.headers.get('User-Agent'),
+                        }})
+            return response
@@ -1,4 +1,5 @@
 from flask import render_template, request, jsonify
+from ..exceptions import ServiceUnavailable
 from . import main
 
 
@@ -31,3 +32,14 @@ def internal_server_error(e):
         return response
     return render_template('500.html'), 500
 
+
+@main.app_errorhandler(ServiceUnavailable)
+def service_unavailable(e):
+    if request.accept_mimetypes.accept_json and \
+            not request.accept_mimetypes.accept_html:
+        response = jsonify({'error': 'service unavailable'})
+        response.status_code = 503
+        return response
+    return render_template('error_page.html', code=503,
+                           name='Service Unavailable',
+                           description=e.args[0]), 503
@@ -0,0 +1,381 @@
+import atexit
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# a process whose file is older than this many flush intervals is assumed
+# to be gone even if its PID is in use again
+STALE_INTERVALS = 4
+
+HISTOGRAMS = {
+    'rivalrockets_request_seconds':
+        ('Request latency by endpoint.', LATENCY_BUCKETS),
+    'rivalrockets_request_queries':
+        ('Database queries issued per request.', QUERY_BUCKETS),
+    'rivalrockets_request_db_seconds':
+        ('Time spent in database queries per request.', LATENCY_BUCKETS),
+    'rivalrockets_response_bytes':
+        ('Size of buffered response bodies.', SIZE_BUCKETS),
+}
+
+COUNTERS = {
+    'rivalrockets_responses_total': 'Responses by endpoint and status.',
+    'rivalrockets_cache_hits_total': 'Cache lookups that found an entry.',
+    'rivalrockets_cache_misses_total': 'Cache lookups that found nothing.',
+    'rivalrockets_cache_evictions_total': 'Entries evicted to stay in budget.',
+    'rivalrockets_password_hashes_total': 'Password hash operations.',
+    'rivalrockets_password_hash_seconds_total':
+        'Time spent hashing passwords.',
+    'rivalrockets_password_hashes_rejected_total':
+        'Hash operations refused because the queue was full.',
+    'rivalrockets_mail_sent_total': 'Mails handed to the SMTP server.',
+    'rivalrockets_mail_retried_total': 'Mail deliveries retried after errors.',
+    'rivalrockets_mail_failed_total': 'Mails given up on after errors.',
+    'rivalrockets_mail_dropped_total':
+        'Mails dropped because the queue was full.',
+    'rivalrockets_log_records_dropped_total':
+        'Log records dropped because the queue was full.',
+}
+
+GAUGES = {
+    'rivalrockets_cache_entries': 'Entries held by each cache.',
+    'rivalrockets_mail_queue_depth': 'Mails waiting to be sent.',
+    'rivalrockets_log_queue_depth': 'Log records waiting to be written.',
+}
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').\
+        replace('\n', r'\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value))
+                             for name, value in labels)
+
+
+class MetricsRegistry(object):
+    """Per-process request metrics, aggregated across workers on scrape.
+
+    Recording a request costs a few dictionary updates. When
+    ``RIVALROCKETS_METRICS_DIR`` is set every process writes its totals
+    there every ``RIVALROCKETS_METRICS_FLUSH_INTERVAL`` seconds and at
+    exit, and ``render`` sums the files of all processes, so any gunicorn
+    worker can answer a scrape for the whole server. Files are named after
+    the PID and start time of their process, and the counters and
+    histograms of processes that exited are folded into one archive file
+    so the directory does not grow with every worker restart.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.interval = 15
+        self.counters = {}
+        self.histograms = {}
+        self.caches = {}
+        self.collectors = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._started = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config['RIVALROCKETS_METRICS_DIR']
+        self.interval = app.config['RIVALROCKETS_METRICS_FLUSH_INTERVAL']
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        if not event.contains(Engine, 'before_cursor_execute',
+                              self.before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         self.before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         self.after_cursor_execute)
+
+    def track_cache(self, name, cache):
+        """Export the hit, miss and size counters of an ``LRUCache``."""
+        self.caches[name] = cache
+
+    def add_collector(self, collector):
+        """Register a callable returning ``(kind, name, labels, value)``."""
+        self.collectors.append(collector)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            values = self.histograms.get(key)
+            if values is None:
+                # one count per bucket, then +Inf, sum and count
+                values = self.histograms[key] = [0] * (len(buckets) + 3)
+            values[bisect_left(buckets, value)] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        self._local.started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        started = getattr(self._local, 'started', None)
+        if started is not None and getattr(self._local, 'active', False):
+            self._local.queries += 1
+            self._local.db_seconds += time.perf_counter() - started
+
+    def before_request(self):
+        self._local.active = True
+        self._local.queries = 0
+        self._local.db_seconds = 0.0
+        g.metrics_started = time.perf_counter()
+        self._start()
+
+    def after_request(self, response):
+        self.record(response.status_code, response)
+        return response
+
+    def teardown_request(self, exc):
+        if exc is not None:
+            self.record(500)
+
+    def record(self, status, response=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        self._local.active = False
+        labels = (('endpoint', request.endpoint or 'none'),
+                  ('method', request.method))
+        self.observe('rivalrockets_request_seconds', labels,
+                     time.perf_counter() - started)
+        self.observe('rivalrockets_request_queries', labels,
+                     self._local.queries)
+        self.observe('rivalrockets_request_db_seconds', labels,
+                     self._local.db_seconds)
+        if response is not None and not response.is_streamed and \
+                response.content_length is not None:
+            self.observe('rivalrockets_response_bytes', labels,
+                         response.content_length)
+        self.inc('rivalrockets_responses_total',
+                 labels + (('status', status),))
+
+    def snapshot(self):
+        """Return this process's metrics as a JSON-serializable dict."""
+        counters = []
+        gauges = []
+        for name, cache in sorted(self.caches.items()):
+            labels = (('cache', name),)
+            counters.append(('rivalrockets_cache_hits_total', labels,
+                             cache.hits))
+            counters.append(('rivalrockets_cache_misses_total', labels,
+                             cache.misses))
+            counters.append(('rivalrockets_cache_evictions_total', labels,
+                             getattr(cache, 'evictions', 0)))
+            if hasattr(cache, '__len__'):
+                gauges.append(('rivalrockets_cache_entries', labels,
+                               len(cache)))
+        for collector in self.collectors:
+            for kind, name, labels, value in collector():
+                (counters if kind == 'counter' else gauges).append(
+                    (name, labels, value))
+        with self._lock:
+            counters.extend((name, labels, value) for (name, labels), value
+                            in self.counters.items())
+            histograms = [(name, labels, list(values)) for (name, labels),
+                          values in self.histograms.items()]
+        return {'pid': os.getpid(), 'started': self._started,
+                'counters': counters, 'gauges': gauges,
+                'histograms': histograms}
+
+    def path(self, pid, started):
+        return os.path.join(self.directory,
+                            'metrics-%d-%d.json' % (pid, started))
+
+    @staticmethod
+    def write(path, snapshot):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def dump(self):
+        if not self.directory or self._pid != os.getpid():
+            return
+        self.write(self.path(os.getpid(), self._started), self.snapshot())
+
+    def _start(self):
+        # timer threads do not survive a fork, so start one per worker
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._started = int(time.time() * 1000)
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.dump)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.dump()
+            except Exception:
+                self.app.logger.exception('Could not write metrics')
+
+    @staticmethod
+    def alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @contextmanager
+    def _exclusive(self):
+        # one process at a time reads the files and folds the dead ones
+        with open(os.path.join(self.directory, 'metrics.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as f:
+                return json.load(f), os.fstat(f.fileno()).st_mtime
+        except (IOError, ValueError):
+            return None, None
+
+    @staticmethod
+    def totals(snapshots):
+        """Sum the counters and histograms of ``snapshots``."""
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = histograms.get(key)
+                if total is None:
+                    histograms[key] = list(values)
+                else:
+                    histograms[key] = [a + b for a, b in zip(total, values)]
+        return counters, histograms
+
+    def snapshots(self):
+        """Return ``(snapshot, live)`` for this and every other process.
+
+        Files of processes that exited are folded into the archive, which
+        comes back as one more snapshot, and removed.
+        """
+        snapshots = [(self.snapshot(), True)]
+        if not self.directory:
+            return snapshots
+        archive_path = os.path.join(self.directory, 'metrics-archive.json')
+        fresh_after = time.time() - STALE_INTERVALS * self.interval
+        with self._exclusive():
+            archive, mtime = self.load(archive_path)
+            dead = []
+            for path in glob.glob(os.path.join(self.directory,
+                                               'metrics-*-*.json')):
+                snapshot, mtime = self.load(path)
+                if snapshot is None or \
+                        (snapshot['pid'], snapshot['started']) == \
+                        (os.getpid(), self._started):
+                    continue
+                if self.alive(snapshot['pid']):
+                    snapshots.append((snapshot, mtime > fresh_after))
+                else:
+                    dead.append((path, snapshot))
+            if dead:
+                counters, histograms = self.totals(
+                    ([archive] if archive is not None else []) +
+                    [snapshot for path, snapshot in dead])
+                archive = {
+                    'counters': [(name, labels, value) for (name, labels),
+                                 value in counters.items()],
+                    'gauges': [],
+                    'histograms': [(name, labels, values) for (name, labels),
+                                   values in histograms.items()],
+                }
+                self.write(archive_path, archive)
+                for path, snapshot in dead:
+                    os.remove(path)
+        if archive is not None:
+            snapshots.append((archive, False))
+        return snapshots
+
+    def render(self):
+        """Return the metrics of every process in Prometheus text format.
+
+        Counters and histograms of exited processes are kept so totals
+        never go backwards; gauges only count processes that are running
+        and still writing their file.
+        """
+        snapshots = self.snapshots()
+        counters, histograms = self.totals(snapshot for snapshot, live
+                                           in snapshots)
+        gauges = {}
+        for snapshot, live in snapshots:
+            if live:
+                for name, labels, value in snapshot['gauges']:
+                    key = (name, tuple(tuple(label) for label in labels))
+                    gauges[key] = gauges.get(key, 0) + value
+        lines = []
+        for kind, helps, samples in (('counter', COUNTERS, counters),
+                                     ('gauge', GAUGES, gauges)):
+            for name in sorted(set(name for name, labels in samples)):
+                lines.append('# HELP %s %s' % (name, helps.get(name, name)))
+                lines.append('# TYPE %s %s' % (name, kind))
+                for (sample, labels), value in sorted(samples.items()):
+                    if sample == name:
+                        lines.append('%s%s %s' % (name, format_labels(labels),
+                                                  repr(float(value))))
+        for name in sorted(set(name for name, labels in histograms)):
+            help, buckets = HISTOGRAMS[name]
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s histogram' % name)
+            for (sample, labels), values in sorted(histograms.items()):
+                if sample != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, format_labels(
+                        labels + (('le', bound),)), cumulative))
+                lines.append('%s_sum%s %s' % (name, format_labels(labels),
+                                              repr(float(values[-2]))))
+                lines.append('%s_count%s %d' % (name, format_labels(labels),
+                                                values[-1]))
+        return '\n'.join(lines) + '\n'
@@ -1,13 +1,15 @@
 from datetime import datetime
 import hashlib
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
-import bleach
 from flask import current_app, request, url_for
 from flask_login import UserMixin, AnonymousUserMixin
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, scoped_session
 from app.exceptions import ValidationError
-from . import db, login_manager
+from . import db, login_manager, password_hasher, last_seen_buffer, \
+    html_renderer, hardware_index, fulltext_index, similarity_index, \
+    response_cache
 
 
 class Permission:
@@ -64,7 +66,10 @@ class User(UserMixin, db.Model):
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     avatar_hash = db.Column(db.String(32))
+    machine_count = db.Column(db.Integer, default=0, nullable=False)
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
     machines = db.relationship('Machine', backref='author', lazy='dynamic')
+    revisions = db.relationship('Revision', backref='author', lazy='dynamic')
     comments = db.relationship('Comment', backref='author', lazy='dynamic')
 
     def __init__(self, **kwargs):
@@ -84,10 +89,10 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.generate(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.check(self.password_hash, password)
 
     def generate_confirmation_token(self, expiration=3600):
         s = Serializer(current_app.config['SECRET_KEY'], expiration)
@@ -152,8 +157,7 @@ class User(UserMixin, db.Model):
         return self.can(Permission.ADMINISTER)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
+        last_seen_buffer.record(self)
 
     def gravatar(self, size=100, default='retro', rating='g'):
         if request.is_secure:
@@ -172,7 +176,7 @@ class User(UserMixin, db.Model):
             'member_since': self.member_since,
             'last_seen': self.last_seen,
             'machines': url_for('api.get_user_machines', id=self.id, _external=True),
-            'machine_count': self.machines.count()
+            'machine_count': self.machine_count
         }
         return json_user
 
@@ -182,13 +186,20 @@ class User(UserMixin, db.Model):
         return s.dumps({'id': self.id}).decode('ascii')
 
     @staticmethod
-    def verify_auth_token(token):
+    def decode_auth_token(token):
         s = Serializer(current_app.config['SECRET_KEY'])
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except:
             return None
-        return User.query.get(data['id'])
+        return data['id'], header['exp']
+
+    @staticmethod
+    def verify_auth_token(token):
+        claims = User.decode_auth_token(token)
+        if claims is None:
+            return None
+        return User.query.get(claims[0])
 
     def __repr__(self):
         return '<User %r>' % self.username
@@ -211,18 +222,39 @@ def load_user(user_id):
 
 class Machine(db.Model):
     __tablename__ = 'machines'
+    __table_args__ = (
+        db.Index('ix_machines_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_machines_author_id_timestamp', 'author_id', 'timestamp',
+                 'id'),
+        db.Index('ix_machines_author_id_external_id', 'author_id',
+                 'external_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     system_name = db.Column(db.Text)
     system_notes = db.Column(db.Text)
     system_notes_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
     owner = db.Column(db.Text)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     active_revision_id = db.Column(db.Integer, db.ForeignKey('machines.id'))
+    external_id = db.Column(db.String(64))
+    revision_count = db.Column(db.Integer, default=0, nullable=False)
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
 
-    revisions = db.relationship('Revision', backref='machines', lazy='dynamic')
+    revisions = db.relationship('Revision', backref='machine', lazy='dynamic')
     comments = db.relationship('Comment', backref='machine', lazy='dynamic')
 
+    @staticmethod
+    def on_changed_system_notes(target, value, oldvalue, initiator):
+        html_renderer.update(target, 'system_notes', 'system_notes_html',
+                             value)
+
+    def cache_tags(self):
+        return ['machines', 'machine:%s' % self.id,
+                'user:%s:machines' % self.author_id]
+
     def to_json(self):
         json_machine = {
             'url': url_for('api.get_machine', id=self.id, _external=True),
@@ -234,10 +266,10 @@ class Machine(db.Model):
             'author': url_for('api.get_user', id=self.author_id, _external=True),
             'revisions': url_for('api.get_machine_revisions', id=self.id,
                                  _external=True),
-            'revision_count': self.revisions.count(),
+            'revision_count': self.revision_count,
             'comments': url_for('api.get_machine_comments', id=self.id,
                                 _external=True),
-            'comment_count': self.comments.count()
+            'comment_count': self.comment_count
         }
         return json_machine
 
@@ -253,23 +285,33 @@ class Machine(db.Model):
                        owner=owner)
 
 
+db.event.listen(Machine.system_notes, 'set', Machine.on_changed_system_notes)
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_comments_machine_id_timestamp', 'machine_id', 'timestamp',
+                 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     machine_id = db.Column(db.Integer, db.ForeignKey('machines.id'))
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        html_renderer.update(target, 'body', 'body_html', value)
+
+    def cache_tags(self):
+        return ['comments', 'comment:%s' % self.id,
+                'machine:%s:comments' % self.machine_id]
 
     def to_json(self):
         json_comment = {
@@ -296,6 +338,13 @@ db.event.listen(Comment.body, 'set', Comment.on_changed_body)
 
 class Revision(db.Model):
     __tablename__ = 'revisions'
+    __table_args__ = (
+        db.Index('ix_revisions_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_revisions_machine_id_timestamp', 'machine_id',
+                 'timestamp', 'id'),
+        db.Index('ix_revisions_author_id_external_id', 'author_id',
+                 'external_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     cpu_make = db.Column(db.String(64))
     cpu_name = db.Column(db.String(64))
@@ -312,16 +361,25 @@ class Revision(db.Model):
     revision_notes_html = db.Column(db.Text)
     pcpartpicker_url = db.Column(db.String(128))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                           onupdate=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     machine_id = db.Column(db.Integer, db.ForeignKey('machines.id'))
+    external_id = db.Column(db.String(64))
+
+    EDITABLE_FIELDS = ('cpu_make', 'cpu_name', 'cpu_socket', 'cpu_mhz',
+                       'cpu_proc_cores', 'chipset', 'system_memory_mb',
+                       'system_memory_mhz', 'gpu_name', 'gpu_make',
+                       'gpu_memory_mb', 'revision_notes', 'pcpartpicker_url')
 
     @staticmethod
     def on_changed_revision_notes(target, value, oldvalue, initiator):
-        allowed_tags = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i',
-                        'strong']
-        target.revision_notes_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, strip=True))
+        html_renderer.update(target, 'revision_notes', 'revision_notes_html',
+                             value)
+
+    def cache_tags(self):
+        return ['revisions', 'revision:%s' % self.id,
+                'machine:%s:revisions' % self.machine_id]
 
     def to_json(self):
         json_revision = {
@@ -352,9 +410,326 @@ class Revision(db.Model):
         cpu_make = json_revision.get('cpu_make')
         if cpu_make is None or cpu_make == '':
             raise ValidationError('Revision does not have cpu_make')
-        revision_notes = json_revision.get('revision_notes')
+        fields = dict((field, json_revision.get(field))
+                      for field in Revision.EDITABLE_FIELDS)
+        fields['cpu_make'] = cpu_make
+
+        return Revision(**fields)
+
+
+db.event.listen(Revision.revision_notes, 'set', Revision.on_changed_revision_notes)
+
+
+# Denormalized row counters: (counted model, foreign key attribute,
+# counter table, counter column).
+COUNTERS = (
+    (Machine, 'author_id', User.__table__, 'machine_count'),
+    (Comment, 'author_id', User.__table__, 'comment_count'),
+    (Comment, 'machine_id', Machine.__table__, 'comment_count'),
+    (Revision, 'machine_id', Machine.__table__, 'revision_count'),
+)
+
+
+def update_counters(session, flush_context):
+    deltas = {}
+    changes = [(instance, 1) for instance in session.new] + \
+        [(instance, -1) for instance in session.deleted]
+    for instance, delta in changes:
+        for model, key, table, column in COUNTERS:
+            if not isinstance(instance, model):
+                continue
+            parent_id = getattr(instance, key)
+            if parent_id is not None:
+                counter = (table, column, parent_id)
+                deltas[counter] = deltas.get(counter, 0) + delta
+    for (table, column, parent_id), delta in deltas.items():
+        if delta:
+            session.execute(table.update().
+                            where(table.c.id == parent_id).
+                            values({column: table.c[column] + delta}))
+
+
+db.event.listen(SignallingSession, 'after_flush', update_counters)
+
+
+def increment(connection, table, key, amounts):
+    """Add ``amounts`` to the row of ``table`` matching ``key``.
+
+    The row is created when it does not exist yet. Two transactions may
+    both find it missing; the one whose INSERT loses the race rolls back
+    to a savepoint and repeats the UPDATE instead of failing.
+    """
+    if isinstance(connection, (Session, scoped_session)):
+        connection = connection.connection()
+    update = table.update().values(dict((name, table.c[name] + amount)
+                                        for name, amount in amounts.items()))
+    for name, value in key.items():
+        update = update.where(table.c[name] == value)
+    if connection.execute(update).rowcount:
+        return
+    row = dict(key, **amounts)
+    if connection.dialect.name == 'sqlite':
+        # the UPDATE already took SQLite's database-wide write lock, so
+        # nobody else can insert the row meanwhile
+        connection.execute(table.insert(), row)
+        return
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(table.insert(), row)
+    except IntegrityError:
+        savepoint.rollback()
+        connection.execute(update)
+    else:
+        savepoint.commit()
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+    @staticmethod
+    def insert_tables():
+        for table in db.metadata.sorted_tables:
+            if table.name != TableVersion.__tablename__ and \
+                    TableVersion.query.get(table.name) is None:
+                db.session.add(TableVersion(name=table.name, version=0))
+        db.session.commit()
+
+    @staticmethod
+    def current(names):
+        versions = dict(db.session.query(TableVersion.name,
+                                         TableVersion.version).
+                        filter(TableVersion.name.in_(names)))
+        return tuple(versions.get(name, 0) for name in names)
+
+    @staticmethod
+    def on_flush(session, flush_context):
+        names = set()
+        for instance in session.new | session.dirty | session.deleted:
+            if isinstance(instance, TableVersion) or \
+                    not hasattr(instance, '__table__'):
+                continue
+            names.add(instance.__table__.name)
+            for model, key, table, column in COUNTERS:
+                if isinstance(instance, model):
+                    names.add(table.name)
+        TableVersion.bump(session, names)
+
+    @staticmethod
+    def bump(session, names):
+        if isinstance(session, (Session, scoped_session)):
+            # responses embedding these tables are tagged with their names
+            session.info.setdefault('bumped_tables', set()).update(names)
+        for name in sorted(names):
+            increment(session, TableVersion.__table__, {'name': name},
+                      {'version': 1})
+
+    @staticmethod
+    def invalidate(session):
+        names = session.info.pop('bumped_tables', None)
+        if names:
+            response_cache.invalidate(*sorted(names))
+
+    @staticmethod
+    def discard(session):
+        session.info.pop('bumped_tables', None)
+
+
+db.event.listen(SignallingSession, 'after_flush', TableVersion.on_flush)
+db.event.listen(SignallingSession, 'after_commit', TableVersion.invalidate)
+db.event.listen(SignallingSession, 'after_rollback', TableVersion.discard)
+db.event.listen(SignallingSession, 'after_flush', html_renderer.collect)
+db.event.listen(SignallingSession, 'after_commit', html_renderer.enqueue)
+db.event.listen(SignallingSession, 'after_rollback', html_renderer.discard)
+db.event.listen(SignallingSession, 'after_flush', hardware_index.collect)
+db.event.listen(SignallingSession, 'after_commit', hardware_index.apply)
+db.event.listen(SignallingSession, 'after_rollback', hardware_index.discard)
+db.event.listen(SignallingSession, 'after_flush', similarity_index.collect)
+db.event.listen(SignallingSession, 'after_commit', similarity_index.apply)
+db.event.listen(SignallingSession, 'after_rollback', similarity_index.discard)
+db.event.listen(SignallingSession, 'after_flush', fulltext_index.sync)
+db.event.listen(db.metadata, 'after_create', fulltext_index.create_table)
+
+
+def recount(model, key, parent_ids=None):
+    for counted_model, counted_key, table, column in COUNTERS:
+        if counted_model is not model or counted_key != key:
+            continue
+        counted = model.__table__
+        statement = table.update().values({
+            column: db.select([db.func.count(counted.c.id)]).
+            where(counted.c[key] == table.c.id).as_scalar()})
+        if parent_ids is not None:
+            statement = statement.where(table.c.id.in_(parent_ids))
+        db.session.execute(statement)
+
+
+def reconcile_counters():
+    """Recount drifted counters and evict the responses showing them."""
+    tags = set()
+    for model, key, table, column in COUNTERS:
+        counted = model.__table__
+        actual = db.select([db.func.count(counted.c.id)]).\
+            where(counted.c[key] == table.c.id).as_scalar()
+        rows = db.session.execute(db.select([table]).
+                                  where(table.c[column] != actual)).fetchall()
+        if not rows:
+            continue
+        ids = [row.id for row in rows]
+        for i in range(0, len(ids), 500):
+            recount(model, key, ids[i:i + 500])
+        TableVersion.bump(db.session, [table.name])
+        for row in rows:
+            if table is Machine.__table__:
+                tags.update(['machine:%d' % row.id,
+                             'user:%s:machines' % row.author_id])
+            else:
+                tags.add('user:%d' % row.id)
+    db.session.commit()
+    response_cache.invalidate(*sorted(tags))
+
+
+# (model, Markdown source column, rendered HTML column)
+RENDERED_FIELDS = (
+    (Machine, 'system_notes', 'system_notes_html'),
+    (Comment, 'body', 'body_html'),
+    (Revision, 'revision_notes', 'revision_notes_html'),
+)
+
+
+class HardwareRollup(db.Model):
+    """Running totals of revision specs per dimension value and month.
+
+    ``month`` is ``'YYYY-MM'`` or ``ALL_MONTHS`` for the all-time row.
+    Sums and counts only include non-NULL values, so ``sum / count`` is
+    the average of the revisions that reported the field.
+    """
+    __tablename__ = 'hardware_rollups'
+    DIMENSIONS = ('cpu_make', 'cpu_name', 'gpu_name', 'cpu_socket')
+    METRICS = ('cpu_mhz', 'cpu_proc_cores', 'system_memory_mb',
+               'gpu_memory_mb')
+    ALL_MONTHS = '*'
+    dimension = db.Column(db.String(16), primary_key=True)
+    value = db.Column(db.String(64), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    revision_count = db.Column(db.Integer, default=0, nullable=False)
+    cpu_mhz_sum = db.Column(db.BigInteger, default=0, nullable=False)
+    cpu_mhz_count = db.Column(db.Integer, default=0, nullable=False)
+    cpu_proc_cores_sum = db.Column(db.BigInteger, default=0, nullable=False)
+    cpu_proc_cores_count = db.Column(db.Integer, default=0, nullable=False)
+    system_memory_mb_sum = db.Column(db.BigInteger, default=0,
+                                     nullable=False)
+    system_memory_mb_count = db.Column(db.Integer, default=0, nullable=False)
+    gpu_memory_mb_sum = db.Column(db.BigInteger, default=0, nullable=False)
+    gpu_memory_mb_count = db.Column(db.Integer, default=0, nullable=False)
+
+    COLUMNS = DIMENSIONS + METRICS + ('timestamp',)
+
+    @staticmethod
+    def keys(values):
+        timestamp = values.get('timestamp') or datetime.utcnow()
+        month = timestamp.strftime('%Y-%m')
+        keys = [('month', month, HardwareRollup.ALL_MONTHS)]
+        for dimension in HardwareRollup.DIMENSIONS:
+            value = values.get(dimension) or ''
+            keys.append((dimension, value, month))
+            keys.append((dimension, value, HardwareRollup.ALL_MONTHS))
+        return keys
+
+    @staticmethod
+    def accumulate(deltas, values, sign):
+        """Add (``sign`` 1) or remove (-1) one revision from ``deltas``."""
+        metrics = []
+        for metric in HardwareRollup.METRICS:
+            value = values.get(metric)
+            try:
+                value = int(value) if value is not None else None
+            except (TypeError, ValueError):
+                value = None
+            metrics.append(value)
+        for key in HardwareRollup.keys(values):
+            delta = deltas.setdefault(key, [0] * (1 + 2 * len(metrics)))
+            delta[0] += sign
+            for index, value in enumerate(metrics):
+                if value is not None:
+                    delta[1 + 2 * index] += sign * value
+                    delta[2 + 2 * index] += sign
+
+    @staticmethod
+    def apply(connection, deltas):
+        table = HardwareRollup.__table__
+        names = ['revision_count']
+        for metric in HardwareRollup.METRICS:
+            names.extend((metric + '_sum', metric + '_count'))
+        for (dimension, value, month), delta in sorted(deltas.items()):
+            if not any(delta):
+                continue
+            increment(connection, table,
+                      {'dimension': dimension, 'value': value,
+                       'month': month}, dict(zip(names, delta)))
+
+    @staticmethod
+    def on_flush(session, flush_context):
+        deltas = {}
+        for instance in session.new | session.dirty | session.deleted:
+            if not isinstance(instance, Revision):
+                continue
+            current = dict((column, getattr(instance, column))
+                           for column in HardwareRollup.COLUMNS)
+            if instance in session.new:
+                HardwareRollup.accumulate(deltas, current, 1)
+                continue
+            attrs = db.inspect(instance).attrs
+            previous = {}
+            for column in HardwareRollup.COLUMNS:
+                history = attrs[column].history
+                if history.deleted:
+                    previous[column] = history.deleted[0]
+                elif history.added:
+                    previous[column] = None
+                else:
+                    previous[column] = current[column]
+            if instance in session.deleted:
+                HardwareRollup.accumulate(deltas, previous, -1)
+            elif previous != current:
+                HardwareRollup.accumulate(deltas, previous, -1)
+                HardwareRollup.accumulate(deltas, current, 1)
+        if deltas:
+            HardwareRollup.apply(session, deltas)
+
+    @staticmethod
+    def rebuild(connection, batch_size=10000):
+        revisions = Revision.__table__
+        deltas = {}
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                db.select([revisions.c.id] +
+                          [revisions.c[c] for c in HardwareRollup.COLUMNS]).
+                where(revisions.c.id > last_id).
+                order_by(revisions.c.id).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            for row in rows:
+                HardwareRollup.accumulate(
+                    deltas, dict(zip(HardwareRollup.COLUMNS, row[1:])), 1)
+        connection.execute(HardwareRollup.__table__.delete())
+        HardwareRollup.apply(connection, deltas)
+
+    def to_json(self):
+        json_rollup = {
+            'value': self.value,
+            'month': None if self.month == self.ALL_MONTHS else self.month,
+            'revision_count': self.revision_count
+        }
+        for metric in self.METRICS:
+            count = getattr(self, metric + '_count')
+            json_rollup['avg_' + metric] = \
+                float(getattr(self, metric + '_sum')) / count if count else None
+        return json_rollup
 
-        return Revision(cpu_make=cpu_make, revision_notes=revision_notes)
 
+db.event.listen(SignallingSession, 'after_flush', HardwareRollup.on_flush)
 
-db.event.listen(Revision.revision_notes, 'set', Revision.on_changed_revision_notes)
\ No newline at end of file
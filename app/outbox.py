@@ -0,0 +1,183 @@
+import atexit
+import os
+import queue
+import smtplib
+import threading
+import time
+
+# put on the queue once per worker to make it exit
+STOP = object()
+
+
+def permanent(error):
+    """Whether retrying ``error`` could not possibly succeed."""
+    return isinstance(error, smtplib.SMTPRecipientsRefused) or \
+        isinstance(error, smtplib.SMTPResponseException) and \
+        error.smtp_code >= 500
+
+
+class MailOutbox(object):
+    """Delivers mail from a bounded queue on a few worker threads.
+
+    Each of the ``RIVALROCKETS_MAIL_WORKERS`` threads keeps one SMTP
+    connection open while there is mail to send, closing it after
+    ``RIVALROCKETS_MAIL_IDLE_TIMEOUT`` idle seconds; ``MAIL_MAX_EMAILS``
+    caps the messages sent per connection. Failed deliveries are retried
+    ``RIVALROCKETS_MAIL_RETRIES`` times, waiting
+    ``RIVALROCKETS_MAIL_RETRY_BACKOFF`` seconds and doubling each time.
+    Mail that does not fit in ``RIVALROCKETS_MAIL_QUEUE_DEPTH`` is dropped
+    and logged, and whatever is queued at exit gets
+    ``RIVALROCKETS_MAIL_SHUTDOWN_TIMEOUT`` seconds to go out. With no
+    workers, mail is sent on the calling thread.
+
+    To try it against a local stand-in, run
+    ``python -m smtpd -n -c DebuggingServer localhost:1025`` and set
+    ``MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0``.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 0
+        self.depth = 0
+        self.idle_timeout = 5
+        self.retries = 3
+        self.backoff = 2
+        self.shutdown_timeout = 10
+        self.queue = None
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'dropped': 0}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['RIVALROCKETS_MAIL_WORKERS']
+        self.depth = app.config['RIVALROCKETS_MAIL_QUEUE_DEPTH']
+        self.idle_timeout = app.config['RIVALROCKETS_MAIL_IDLE_TIMEOUT']
+        self.retries = app.config['RIVALROCKETS_MAIL_RETRIES']
+        self.backoff = app.config['RIVALROCKETS_MAIL_RETRY_BACKOFF']
+        self.shutdown_timeout = \
+            app.config['RIVALROCKETS_MAIL_SHUTDOWN_TIMEOUT']
+
+    def metrics(self):
+        for outcome in ('sent', 'retried', 'failed', 'dropped'):
+            yield ('counter', 'rivalrockets_mail_%s_total' % outcome, (),
+                   self.stats[outcome])
+        yield ('gauge', 'rivalrockets_mail_queue_depth', (),
+               self.queue.qsize() if self._pid == os.getpid() else 0)
+
+    def _count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def send(self, msg):
+        """Queue ``msg`` for delivery; returns False if it was dropped."""
+        if not self.workers:
+            self._deliver(None, msg)
+            return True
+        self._start()
+        try:
+            self.queue.put_nowait(msg)
+        except queue.Full:
+            self._count('dropped')
+            self.app.logger.error('Mail queue is full, dropped %r to %s',
+                                  msg.subject, ', '.join(msg.recipients))
+            return False
+        return True
+
+    def _start(self):
+        # threads do not survive a fork, so each worker gets its own pool
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.depth)
+            self._threads = [threading.Thread(target=self._run)
+                             for _ in range(self.workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+            self._pid = os.getpid()
+        atexit.register(self.stop)
+
+    def _run(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    msg = self.queue.get(timeout=self.idle_timeout
+                                         if connection is not None else None)
+                except queue.Empty:
+                    connection = self._close(connection)
+                    continue
+                try:
+                    if msg is STOP:
+                        self._close(connection)
+                        return
+                    connection = self._deliver(connection, msg)
+                finally:
+                    self.queue.task_done()
+
+    def _deliver(self, connection, msg):
+        """Send ``msg``, retrying with backoff; return the open connection."""
+        from . import mail
+        for attempt in range(self.retries + 1):
+            try:
+                if connection is None:
+                    connection = mail.connect()
+                    connection.__enter__()
+                connection.send(msg)
+            except (smtplib.SMTPException, OSError) as e:
+                # the connection may be unusable now, so start over
+                connection = self._close(connection)
+                if permanent(e) or attempt == self.retries:
+                    self._count('failed')
+                    self.app.logger.error('Could not send %r to %s: %s',
+                                          msg.subject,
+                                          ', '.join(msg.recipients), e)
+                    return None
+                self._count('retried')
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                self._count('sent')
+                if not self.workers:
+                    connection = self._close(connection)
+                return connection
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+    def flush(self, timeout=None):
+        """Wait for the queued mail to be sent; False if time ran out."""
+        if self._pid != os.getpid():
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self):
+        if self._pid != os.getpid():
+            return
+        if not self.flush(self.shutdown_timeout):
+            self.app.logger.error('Gave up on %d unsent mails at exit',
+                                  self.queue.qsize())
+            return
+        for thread in self._threads:
+            self.queue.put(STOP)
+        for thread in self._threads:
+            thread.join(self.shutdown_timeout)
@@ -0,0 +1,127 @@
+import atexit
+import hashlib
+import os
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+from markdown import markdown
+import bleach
+from .cache import LRUCache
+
+ALLOWED_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong']
+
+# sha1 of the Markdown source -> sanitized HTML
+render_cache = LRUCache(max_entries=4096)
+
+
+def render_markdown(value):
+    return bleach.linkify(bleach.clean(
+        markdown(value, output_format='html'),
+        tags=ALLOWED_TAGS, strip=True))
+
+
+def render_html(value):
+    if value is None:
+        return None
+    key = hashlib.sha1(value.encode('utf-8')).hexdigest()
+    html = render_cache.get(key)
+    if html is None:
+        html = render_markdown(value)
+        render_cache.set(key, html)
+    return html
+
+
+class HtmlRenderer(object):
+    """Fills the ``*_html`` columns rendered from Markdown fields.
+
+    Rendering happens inline in the attribute event unless
+    ``RIVALROCKETS_DEFERRED_RENDER`` is set. In that mode a cache miss
+    leaves the column empty and a background worker fills it in after the
+    transaction commits.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.deferred = False
+        self.queue = Queue()
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.deferred = app.config['RIVALROCKETS_DEFERRED_RENDER']
+
+    def update(self, target, source, html, value):
+        if not self.deferred or value is None:
+            setattr(target, html, render_html(value))
+            return
+        cached = render_cache.get(hashlib.sha1(value.encode('utf-8')).
+                                  hexdigest())
+        setattr(target, html, cached)
+        pending = target.__dict__.setdefault('_pending_renders', {})
+        if cached is None:
+            pending[source] = html
+        else:
+            pending.pop(source, None)
+
+    def collect(self, session, flush_context):
+        jobs = session.info.setdefault('pending_renders', [])
+        for instance in session.new | session.dirty:
+            pending = instance.__dict__.pop('_pending_renders', None)
+            for source, html in (pending or {}).items():
+                jobs.append((type(instance), instance.id, source, html,
+                             getattr(instance, source),
+                             instance.cache_tags()))
+
+    def enqueue(self, session):
+        jobs = session.info.pop('pending_renders', None)
+        if jobs:
+            self._start()
+            for job in jobs:
+                self.queue.put(job)
+
+    def discard(self, session):
+        session.info.pop('pending_renders', None)
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        atexit.register(self.queue.join)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self.render(*job)
+            except Exception:
+                self.app.logger.exception('Could not render %s' % (job[:4],))
+            finally:
+                self.queue.task_done()
+
+    def render(self, model, id, source, html, value, tags):
+        from . import db, response_cache
+        from .models import TableVersion
+        table = model.__table__
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                # skip the write if the source changed again meanwhile
+                result = connection.execute(
+                    table.update().
+                    where(table.c.id == id).
+                    where(table.c[source] == value).
+                    values({html: render_html(value)}))
+                if result.rowcount:
+                    TableVersion.bump(connection, [table.name])
+            if result.rowcount:
+                response_cache.invalidate(table.name, *tags)
@@ -0,0 +1,137 @@
+import itertools
+import threading
+import time
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+# engine arguments that only make sense for pooled (non-SQLite) engines
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle')
+
+
+class Replica(object):
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.failed_at = None
+
+    def healthy(self, retry_interval):
+        return self.failed_at is None or \
+            time.time() - self.failed_at > retry_interval
+
+
+class ReplicaSet(object):
+    """Read-only engines that safe-method API requests can be routed to.
+
+    ``RIVALROCKETS_DATABASE_REPLICAS`` lists database URLs, or dicts with a
+    ``url`` and engine options such as ``pool_size``. A replica that
+    raises a connection error is skipped for
+    ``RIVALROCKETS_REPLICA_RETRY_INTERVAL`` seconds; when none is healthy
+    reads go to the primary.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['rivalrockets_replicas'] = {
+            'replicas': None,
+            'cycle': None,
+        }
+
+    def state(self, app):
+        state = app.extensions['rivalrockets_replicas']
+        if state['replicas'] is None:
+            with self._lock:
+                if state['replicas'] is None:
+                    replicas = [self.connect(app, spec) for spec in
+                                app.config['RIVALROCKETS_DATABASE_REPLICAS']]
+                    state['cycle'] = itertools.cycle(replicas)
+                    state['replicas'] = replicas
+        return state
+
+    def connect(self, app, spec):
+        if isinstance(spec, dict):
+            options = dict(spec)
+            url = options.pop('url')
+        else:
+            url = spec
+            options = {}
+            if app.config['RIVALROCKETS_REPLICA_POOL_SIZE'] is not None:
+                options['pool_size'] = \
+                    app.config['RIVALROCKETS_REPLICA_POOL_SIZE']
+        if make_url(url).drivername.startswith('sqlite'):
+            for name in POOL_OPTIONS:
+                options.pop(name, None)
+        replica = Replica(url, create_engine(url, **options))
+
+        @event.listens_for(replica.engine, 'handle_error')
+        def mark_failed(context):
+            if context.is_disconnect or context.connection is None:
+                replica.failed_at = time.time()
+                app.logger.warning('Database replica %s failed: %s',
+                                   make_url(url).__to_string__(),
+                                   context.original_exception)
+
+        return replica
+
+    def choose(self, app):
+        """Return a healthy replica engine, or None to use the primary."""
+        state = self.state(app)
+        replicas = state['replicas']
+        retry_interval = app.config['RIVALROCKETS_REPLICA_RETRY_INTERVAL']
+        with self._lock:
+            for _ in range(len(replicas)):
+                replica = next(state['cycle'])
+                if replica.healthy(retry_interval):
+                    return replica.engine
+        return None
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads to ``info['replica']`` when one is set.
+
+    Flushes, Core DML, models with a ``__bind_key__`` and everything that
+    runs after the session first flushed stay on the primary, so a request
+    never reads back older data than it has written itself.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and \
+                not self.info.get('wrote') and \
+                not isinstance(clause, UpdateBase):
+            info = getattr(getattr(mapper, 'mapped_table', None), 'info', {})
+            if info.get('bind_key') is None:
+                return replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+def mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+
+event.listen(RoutingSession, 'after_flush', mark_written)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """``SQLAlchemy`` extension whose sessions can read from replicas."""
+
+    def __init__(self, *args, **kwargs):
+        self.replicas = ReplicaSet()
+        SQLAlchemy.__init__(self, *args, **kwargs)
+
+    def init_app(self, app):
+        SQLAlchemy.init_app(self, app)
+        self.replicas.init_app(app)
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def use_replica(self):
+        """Route the current session's reads to a replica, if there is one."""
+        app = self.get_app()
+        if app.config['RIVALROCKETS_DATABASE_REPLICAS']:
+            session = self.session()
+            session.info['replica'] = self.replicas.choose(app)
@@ -0,0 +1,279 @@
+import csv
+import io
+import random
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from werkzeug.security import generate_password_hash
+from . import db, fulltext_index
+from .models import Role, User, Machine, Comment, Revision, TableVersion, \
+    HardwareRollup, RENDERED_FIELDS, reconcile_counters
+from .rendering import render_markdown
+
+# (weight, make, name, socket, base MHz, cores, chipsets)
+CPUS = (
+    (14, 'Intel', 'Core i7-6700K', 'LGA1151', 4000, 4, ('Z170', 'H170')),
+    (12, 'Intel', 'Core i5-6600K', 'LGA1151', 3500, 4, ('Z170', 'H170')),
+    (9, 'Intel', 'Core i7-4790K', 'LGA1150', 4000, 4, ('Z97', 'H97')),
+    (8, 'Intel', 'Core i5-4690K', 'LGA1150', 3500, 4, ('Z97', 'H97')),
+    (5, 'Intel', 'Core i7-5820K', 'LGA2011-v3', 3300, 6, ('X99',)),
+    (2, 'Intel', 'Core i7-6950X', 'LGA2011-v3', 3000, 10, ('X99',)),
+    (6, 'Intel', 'Core i3-6100', 'LGA1151', 3700, 2, ('H110', 'B150')),
+    (3, 'Intel', 'Pentium G4400', 'LGA1151', 3300, 2, ('H110',)),
+    (8, 'AMD', 'FX-8350', 'AM3+', 4000, 8, ('990FX', '970')),
+    (6, 'AMD', 'FX-6300', 'AM3+', 3500, 6, ('970',)),
+    (4, 'AMD', 'A10-7850K', 'FM2+', 3700, 4, ('A88X',)),
+    (3, 'AMD', 'Athlon X4 860K', 'FM2+', 3700, 4, ('A88X', 'A68H')),
+)
+
+# (weight, make, name, memory MB)
+GPUS = (
+    (12, 'NVIDIA', 'GeForce GTX 970', 4096),
+    (10, 'NVIDIA', 'GeForce GTX 1070', 8192),
+    (8, 'NVIDIA', 'GeForce GTX 1080', 8192),
+    (7, 'NVIDIA', 'GeForce GTX 960', 2048),
+    (4, 'NVIDIA', 'GeForce GTX 980 Ti', 6144),
+    (8, 'AMD', 'Radeon RX 480', 8192),
+    (6, 'AMD', 'Radeon R9 390', 8192),
+    (4, 'AMD', 'Radeon R9 380', 4096),
+    (3, 'AMD', 'Radeon R9 Fury', 4096),
+    (5, None, None, None),
+)
+
+# (weight, MB, MHz)
+MEMORY = (
+    (30, 8192, 2133), (20, 16384, 2400), (10, 16384, 3000),
+    (8, 16384, 1600), (12, 8192, 1600), (5, 32768, 2666), (5, 4096, 1333),
+)
+
+NOTE_SENTENCES = 2000
+
+EPOCH = datetime(2014, 1, 1)
+SPAN = timedelta(days=3 * 365)
+
+
+def weighted(rng, choices):
+    total = sum(choice[0] for choice in choices)
+    point = rng.uniform(0, total)
+    for choice in choices:
+        point -= choice[0]
+        if point <= 0:
+            return choice[1:]
+    return choices[-1][1:]
+
+
+def postgres_copy(connection, table, rows):
+    """Load ``rows`` (a list of dicts) with ``COPY ... FROM STDIN``."""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([r'\N' if row[column] is None else row[column]
+                         for column in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')' %
+            (table.name, ', '.join(columns)), buffer)
+    finally:
+        cursor.close()
+
+
+class Seeder(object):
+    """Bulk-generates users, machines, revisions and comments.
+
+    Rows are appended after the existing ones, written in batches of
+    ``batch_size`` through Core ``executemany`` (``COPY`` on Postgres),
+    and their Markdown fields are rendered on a process pool. The same
+    ``seed`` always produces the same data.
+    """
+
+    def __init__(self, seed=0, batch_size=10000, processes=None,
+                 password='password'):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.batch_size = batch_size
+        self.processes = processes
+        self.password = password
+        self.html = dict((model.__tablename__, (source, html))
+                         for model, source, html in RENDERED_FIELDS)
+
+    def run(self, users, machines, revisions, comments):
+        import forgery_py
+        # ForgeryPy draws from the global generator
+        random.seed(self.seed)
+        self.forgery = forgery_py
+        self.sentences = [forgery_py.lorem_ipsum.sentence()
+                          for _ in range(NOTE_SENTENCES)]
+        connection = db.session.connection()
+        self.copy = connection.dialect.name == 'postgresql' and \
+            connection.dialect.driver == 'psycopg2'
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            saved = (connection.execute('PRAGMA synchronous').scalar(),
+                     connection.execute('PRAGMA journal_mode').scalar())
+            # a crash half way leaves a corrupt file, which is fine for
+            # generated data and makes the inserts several times faster
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('PRAGMA journal_mode = OFF')
+        self.pool = Pool(self.processes)
+        try:
+            self.role_id = db.session.query(Role.id).filter_by(
+                default=True).scalar()
+            self.users = self.write(User, users, self.user_rows)
+            self.machines = self.write(Machine, machines, self.machine_rows)
+            if (revisions or comments) and \
+                    (None in self.users or None in self.machines):
+                raise ValueError('revisions and comments need users and '
+                                 'machines to refer to')
+            self.write(Revision, revisions, self.revision_rows)
+            self.write(Comment, comments, self.comment_rows)
+            db.session.commit()
+            reconcile_counters()
+            HardwareRollup.rebuild(db.session)
+            TableVersion.bump(db.session, ['users', 'machines', 'revisions',
+                                           'comments', 'hardware_rollups'])
+            db.session.commit()
+        finally:
+            self.pool.close()
+            self.pool.join()
+            if sqlite:
+                db.session.rollback()
+                connection = db.session.connection()
+                connection.execute('PRAGMA journal_mode = %s' % saved[1])
+                connection.execute('PRAGMA synchronous = %d' % saved[0])
+                db.session.commit()
+        with db.engine.begin() as connection:
+            for kind, last_id in fulltext_index.rebuild(connection,
+                                                        self.batch_size):
+                pass
+        return {'users': users, 'machines': machines,
+                'revisions': revisions, 'comments': comments}
+
+    def write(self, model, count, make_rows):
+        """Insert ``count`` rows and return the ids to pick parents from.
+
+        That is the range of the new rows, or of the existing ones when
+        none were asked for.
+        """
+        table = model.__table__
+        last = db.session.query(db.func.max(table.c.id)).scalar() or 0
+        html = self.html.get(table.name)
+        for start in range(0, count, self.batch_size):
+            rows = list(make_rows(last + 1 + start, start,
+                                  min(self.batch_size, count - start), count))
+            if html is not None:
+                source, target = html
+                sources = [row[source] for row in rows if row[source]]
+                rendered = iter(self.pool.map(
+                    render_markdown, sources,
+                    chunksize=max(len(sources) // (4 * (self.processes or 4)),
+                                  1)))
+                for row in rows:
+                    row[target] = next(rendered) if row[source] else None
+            if self.copy:
+                postgres_copy(db.session.connection(), table, rows)
+            else:
+                db.session.execute(table.insert(), rows)
+        query = db.session.query(db.func.min(table.c.id),
+                                 db.func.max(table.c.id))
+        if count:
+            # sequences may have gaps, so ask rather than assume last + 1
+            query = query.filter(table.c.id > last)
+        return query.one()
+
+    def moment(self, index, total):
+        return EPOCH + SPAN * (float(index) / max(total, 1)) + \
+            timedelta(seconds=self.rng.randint(0, 3600))
+
+    def notes(self, probability):
+        if self.rng.random() >= probability:
+            return None
+        return ' '.join(self.rng.choice(self.sentences)
+                        for _ in range(self.rng.randint(1, 5)))
+
+    def pick(self, ids, skew=1.0):
+        # skew > 1 favours low ids, giving a few very active parents
+        first, last = ids
+        return first + int((last - first + 1) * self.rng.random() ** skew)
+
+    def user_rows(self, first_id, start, size, total):
+        password_hash = generate_password_hash(self.password)
+        for index in range(start, start + size):
+            id = first_id + index - start
+            when = self.moment(index, total)
+            yield {
+                'email': 'user%d@example.com' % id,
+                'username': '%s%d' % (self.forgery.internet.user_name(), id),
+                'role_id': self.role_id,
+                'password_hash': password_hash,
+                'confirmed': True,
+                'name': self.forgery.name.full_name(),
+                'location': self.forgery.address.city(),
+                'about_me': self.notes(0.3),
+                'member_since': when,
+                'last_seen': when,
+                'avatar_hash': None,
+                'machine_count': 0,
+                'comment_count': 0,
+            }
+
+    def machine_rows(self, first_id, start, size, total):
+        for index in range(start, start + size):
+            when = self.moment(index, total)
+            yield {
+                'system_name': '%s %s' % (self.forgery.name.company_name(),
+                                          self.rng.choice(('Rig', 'Build',
+                                                           'Box', 'Tower'))),
+                'system_notes': self.notes(0.5),
+                'timestamp': when,
+                'updated_at': when,
+                'owner': self.forgery.name.full_name(),
+                'author_id': self.pick(self.users, skew=2.0),
+                'external_id': None,
+                'revision_count': 0,
+                'comment_count': 0,
+            }
+
+    def revision_rows(self, first_id, start, size, total):
+        for index in range(start, start + size):
+            make, name, socket, mhz, cores, chipsets = weighted(self.rng,
+                                                                CPUS)
+            gpu_make, gpu_name, gpu_memory = weighted(self.rng, GPUS)
+            memory_mb, memory_mhz = weighted(self.rng, MEMORY)
+            # about a third of the revisions run overclocked
+            if self.rng.random() < 0.3:
+                mhz += 100 * self.rng.randint(1, 8)
+            when = self.moment(index, total)
+            yield {
+                'cpu_make': make,
+                'cpu_name': name,
+                'cpu_socket': socket,
+                'cpu_mhz': mhz,
+                'cpu_proc_cores': cores,
+                'chipset': self.rng.choice(chipsets),
+                'system_memory_mb': memory_mb,
+                'system_memory_mhz': memory_mhz,
+                'gpu_make': gpu_make,
+                'gpu_name': gpu_name,
+                'gpu_memory_mb': gpu_memory,
+                'revision_notes': self.notes(0.4),
+                'pcpartpicker_url': None,
+                'timestamp': when,
+                'updated_at': when,
+                'author_id': self.pick(self.users, skew=2.0),
+                'machine_id': self.pick(self.machines, skew=1.5),
+                'external_id': None,
+            }
+
+    def comment_rows(self, first_id, start, size, total):
+        for index in range(start, start + size):
+            when = self.moment(index, total)
+            yield {
+                'body': self.notes(1.0),
+                'timestamp': when,
+                'updated_at': when,
+                'disabled': False,
+                'author_id': self.pick(self.users, skew=2.0),
+                'machine_id': self.pick(self.machines, skew=1.5),
+            }
@@ -0,0 +1,295 @@
+import math
+import threading
+import time
+from sqlalchemy import select
+
+NUMERIC_FEATURES = ('cpu_mhz', 'cpu_proc_cores', 'system_memory_mb',
+                    'system_memory_mhz', 'gpu_memory_mb')
+CATEGORICAL_FEATURES = ('cpu_make', 'cpu_socket', 'chipset', 'gpu_make')
+FEATURES = NUMERIC_FEATURES + CATEGORICAL_FEATURES
+
+# a categorical mismatch sets two one-hot columns apart by this weight each,
+# which adds 1.0 to the squared distance, about one standard deviation of a
+# numeric feature
+ONE_HOT_WEIGHT = math.sqrt(0.5)
+
+# the attributes a build replaces at once
+STATE = ('matrix', 'norms', 'valid', 'machine_ids', 'rows', 'size', 'width',
+         'vocabulary', 'scale')
+
+
+class SimilarityIndex(object):
+    """Nearest-neighbour search over machine spec vectors.
+
+    Each machine is described by its active revision, or its latest one
+    when none is set. Numeric specs are log-scaled and standardized;
+    categorical specs are one-hot encoded. The vectors are rows of a
+    float32 NumPy matrix that grows by doubling, so queries are a single
+    matrix-vector product and an ``argpartition``. Once built, the index
+    is rebuilt on a background thread when it goes stale, and queries
+    keep using the previous build until the new one is ready.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.max_age = None
+        self.built_at = None
+        self.stale = True
+        self.dirty = set()
+        self._pending = None
+        self._building = False
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age = app.config['RIVALROCKETS_SIMILARITY_INDEX_MAX_AGE']
+
+    def _reset(self, capacity=1024, width=64):
+        import numpy as np
+        self.matrix = np.zeros((capacity, width), dtype=np.float32)
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.machine_ids = np.zeros(capacity, dtype=np.int64)
+        self.rows = {}
+        self.size = 0
+        self.width = len(NUMERIC_FEATURES)
+        self.vocabulary = dict((name, {}) for name in CATEGORICAL_FEATURES)
+
+    @staticmethod
+    def _revisions(connection, machine_ids=None):
+        from .models import Machine, Revision
+        machines = Machine.__table__
+        revisions = Revision.__table__
+        query = select([revisions.c.machine_id, revisions.c.id,
+                        machines.c.active_revision_id] +
+                       [revisions.c[name] for name in FEATURES]).\
+            select_from(revisions.join(
+                machines, machines.c.id == revisions.c.machine_id)).\
+            order_by(revisions.c.machine_id, revisions.c.timestamp,
+                     revisions.c.id)
+        if machine_ids is not None:
+            query = query.where(revisions.c.machine_id.in_(machine_ids))
+        chosen = {}
+        result = connection.execution_options(stream_results=True).\
+            execute(query)
+        for row in result:
+            machine_id, revision_id, active_id = row[0], row[1], row[2]
+            current = chosen.get(machine_id)
+            if current is not None and current[0] == active_id:
+                continue
+            chosen[machine_id] = (revision_id, tuple(row[3:]))
+        return dict((machine_id, values)
+                    for machine_id, (revision_id, values) in chosen.items())
+
+    def build(self, connection):
+        with self._lock:
+            # machines patched into the old build while we read are re-read
+            # once the new one is in place
+            self._pending = set()
+            self.stale = False
+        try:
+            specs = self._revisions(connection)
+            fresh = SimilarityIndex()
+            fresh.load(specs)
+        except Exception:
+            with self._lock:
+                self._pending = None
+                self.stale = True
+            raise
+        with self._lock:
+            for name in STATE:
+                setattr(self, name, getattr(fresh, name))
+            self.dirty |= self._pending
+            self._pending = None
+            self.built_at = time.time()
+
+    def load(self, specs):
+        import numpy as np
+        self._reset(capacity=max(1024, len(specs)))
+        # frozen until the next rebuild so incremental rows stay comparable
+        # with the existing ones
+        self.scale = []
+        for index, name in enumerate(NUMERIC_FEATURES):
+            values = [self._log(spec[index]) for spec in specs.values()]
+            values = np.array([value for value in values if value is not None],
+                              dtype=np.float64)
+            if len(values):
+                self.scale.append((values.mean(), values.std() or 1.0))
+            else:
+                self.scale.append((0.0, 1.0))
+        for machine_id, spec in specs.items():
+            self._set(machine_id, spec)
+
+    @staticmethod
+    def _log(value):
+        try:
+            return math.log1p(max(float(value), 0.0))
+        except (TypeError, ValueError):
+            return None
+
+    def _column(self, name, value):
+        vocabulary = self.vocabulary[name]
+        column = vocabulary.get(value)
+        if column is None:
+            column = vocabulary[value] = self.width
+            self.width += 1
+            if self.width > self.matrix.shape[1]:
+                self._grow(self.matrix.shape[0], self.matrix.shape[1] * 2)
+        return column
+
+    def _grow(self, capacity, width):
+        import numpy as np
+        matrix = np.zeros((capacity, width), dtype=np.float32)
+        matrix[:self.matrix.shape[0], :self.matrix.shape[1]] = self.matrix
+        self.matrix = matrix
+        for name in ('norms', 'valid', 'machine_ids'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def vector(self, spec, extend=False):
+        """Encode ``spec``, a tuple ordered like ``FEATURES``.
+
+        Unknown categorical values are added to the vocabulary when
+        ``extend`` is set and ignored otherwise.
+        """
+        import numpy as np
+        columns = []
+        for index, name in enumerate(CATEGORICAL_FEATURES,
+                                     len(NUMERIC_FEATURES)):
+            value = spec[index]
+            if value is None or value == '':
+                continue
+            if extend:
+                columns.append(self._column(name, value))
+            elif value in self.vocabulary[name]:
+                columns.append(self.vocabulary[name][value])
+        vector = np.zeros(self.matrix.shape[1], dtype=np.float32)
+        for index, name in enumerate(NUMERIC_FEATURES):
+            value = self._log(spec[index])
+            if value is not None:
+                mean, std = self.scale[index]
+                vector[index] = (value - mean) / std
+        vector[columns] = ONE_HOT_WEIGHT
+        return vector
+
+    def _set(self, machine_id, spec):
+        vector = self.vector(spec, extend=True)
+        row = self.rows.get(machine_id)
+        if row is None:
+            row = self.size
+            if row >= self.matrix.shape[0]:
+                self._grow(self.matrix.shape[0] * 2, self.matrix.shape[1])
+            self.rows[machine_id] = row
+            self.machine_ids[row] = machine_id
+            self.size += 1
+        self.matrix[row, :] = 0
+        self.matrix[row, :len(vector)] = vector
+        self.norms[row] = float(vector.dot(vector))
+        self.valid[row] = True
+
+    def _discard(self, machine_id):
+        row = self.rows.pop(machine_id, None)
+        if row is not None:
+            self.valid[row] = False
+            self.matrix[row, :] = 0
+
+    def _connect_and_build(self):
+        from . import db
+        connection = db.engine.connect()
+        try:
+            self.build(connection)
+        finally:
+            connection.close()
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                self._connect_and_build()
+        except Exception:
+            self.app.logger.exception('Could not rebuild the similarity index')
+        finally:
+            self._building = False
+
+    def refresh(self):
+        """Build the index if needed and re-read machines marked dirty."""
+        from . import db
+        if self.built_at is None:
+            # nothing to serve yet, so the first build has to be waited for
+            with self._build_lock:
+                if self.built_at is None:
+                    self._connect_and_build()
+            return
+        if self.stale or \
+                self.max_age and time.time() - self.built_at > self.max_age:
+            with self._lock:
+                if not self._building:
+                    self._building = True
+                    thread = threading.Thread(target=self._rebuild)
+                    thread.daemon = True
+                    thread.start()
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            if self._pending is not None:
+                self._pending |= dirty
+        if not dirty:
+            return
+        connection = db.engine.connect()
+        try:
+            specs = self._revisions(connection, sorted(dirty))
+        finally:
+            connection.close()
+        with self._lock:
+            for machine_id in dirty:
+                if machine_id in specs:
+                    self._set(machine_id, specs[machine_id])
+                else:
+                    self._discard(machine_id)
+
+    def spec_of(self, machine_id):
+        from . import db
+        specs = self._revisions(db.session.connection(), [machine_id])
+        return specs.get(machine_id)
+
+    def nearest(self, spec, k, exclude=None):
+        """Return ``[(machine_id, distance)]`` for the ``k`` closest rows."""
+        import numpy as np
+        with self._lock:
+            if not self.size:
+                return []
+            query = self.vector(spec)
+            matrix = self.matrix[:self.size, :len(query)]
+            distances = self.norms[:self.size] - 2 * matrix.dot(query) + \
+                float(query.dot(query))
+            distances[~self.valid[:self.size]] = np.inf
+            if exclude is not None and exclude in self.rows:
+                distances[self.rows[exclude]] = np.inf
+            k = min(k, self.size)
+            candidates = np.argpartition(distances, k - 1)[:k]
+            candidates = candidates[np.argsort(distances[candidates])]
+            return [(int(self.machine_ids[row]),
+                     math.sqrt(max(float(distances[row]), 0.0)))
+                    for row in candidates if np.isfinite(distances[row])]
+
+    def collect(self, session, flush_context):
+        from .models import Machine, Revision
+        machine_ids = session.info.setdefault('similarity', set())
+        for instance in session.new | session.dirty | session.deleted:
+            if isinstance(instance, Revision):
+                machine_ids.add(instance.machine_id)
+            elif isinstance(instance, Machine):
+                machine_ids.add(instance.id)
+
+    def apply(self, session):
+        machine_ids = session.info.pop('similarity', None)
+        if machine_ids:
+            machine_ids.discard(None)
+            with self._lock:
+                self.dirty.update(machine_ids)
+
+    def discard(self, session):
+        session.info.pop('similarity', None)
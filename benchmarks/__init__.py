@@ -0,0 +1,14 @@
+"""Load and latency benchmarks for the Rival Rockets Bench application.
+
+Seed a benchmark database, run the suite and compare against a baseline::
+
+    python -m benchmarks seed --scale 1k
+    python -m benchmarks run --scale 1k --output benchmarks/baselines/1k.json
+    python -m benchmarks run --scale 1k --output current.json
+    python -m benchmarks compare benchmarks/baselines/1k.json current.json
+
+The database is ``BENCH_DATABASE_URL`` (``data-bench.sqlite`` by default),
+never the development or test one. ``run`` reseeds it first, as the write
+scenarios change it; pass ``--no-reseed`` to skip that. The API response
+cache is off, so the read scenarios measure the views and their queries.
+"""
@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from app import create_app, db
+from .runner import QueryCounter, TestClient, HTTPClient, Suite, report, \
+    compare
+from .scenarios import SCENARIOS, fixtures
+from .seed import SCALES, seed
+
+
+def print_result(name, result):
+    queries = result['queries']
+    print('%-32s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %6s queries%s' % (
+        name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+        queries['max'] if queries else '-',
+        '  %d errors' % result['errors'] if result['errors'] else ''))
+
+
+def command_seed(args):
+    app = create_app('benchmark')
+    with app.app_context():
+        counts = seed(args.scale, seed=args.seed, batch_size=args.batch_size)
+    print('seeded %s' % ', '.join('%d %s' % (count, table)
+                                  for table, count in sorted(counts.items())))
+
+
+def command_run(args):
+    if args.reseed:
+        # the write scenarios change the data, so start every run from the
+        # same database; seeding in another process keeps its memory out of
+        # the peak RSS reported for the run
+        subprocess.check_call([
+            sys.executable, '-m', 'benchmarks', 'seed', '--scale', args.scale,
+            '--seed', str(args.seed), '--batch-size', str(args.batch_size)])
+    app = create_app('benchmark')
+    with app.app_context():
+        ids = fixtures()
+    scenarios = [scenario for scenario in SCENARIOS
+                 if not args.only or scenario.name.startswith(args.only)]
+    if args.url:
+        def make_client(headers=None):
+            return HTTPClient(args.url, headers)
+        counter = None
+    else:
+        def make_client(headers=None):
+            return TestClient(app, headers)
+        counter = QueryCounter()
+    suite = Suite(make_client, ids, scenarios, counter)
+    sequential = suite.run_sequential(args.iterations, log=print_result)
+    concurrent = None
+    if args.clients:
+        concurrent = suite.run_concurrent(args.clients, args.requests)
+        print('%d clients: %.1f requests/s, p95 %.2fms, %d errors' % (
+            args.clients, concurrent['throughput'], concurrent['p95_ms'],
+            concurrent['errors']))
+    result = report(args.scale, sequential, concurrent)
+    print('peak RSS %.1f MiB' % (result['peak_rss_bytes'] / 1048576.0))
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+
+
+def command_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    problems = compare(baseline, current, threshold=args.threshold,
+                       min_ms=args.min_ms)
+    for name, problem in problems:
+        print('%-32s %s' % (name, problem))
+    if not problems:
+        print('no regressions')
+    return 1 if problems else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command')
+
+    seed_parser = commands.add_parser('seed', help='create benchmark data')
+    seed_parser.add_argument('--scale', choices=sorted(SCALES), default='1k')
+    seed_parser.add_argument('--seed', type=int, default=0)
+    seed_parser.add_argument('--batch-size', type=int, default=5000)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--scale', choices=sorted(SCALES), default='1k',
+                            help='scale to reseed at, recorded with the '
+                            'results')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--batch-size', type=int, default=5000)
+    run_parser.add_argument('--no-reseed', dest='reseed',
+                            action='store_false',
+                            help='run against the database as it is')
+    run_parser.add_argument('--iterations', type=int, default=50)
+    run_parser.add_argument('--clients', type=int, default=8,
+                            help='concurrent clients, 0 to skip')
+    run_parser.add_argument('--requests', type=int, default=2000,
+                            help='requests issued by the concurrent clients')
+    run_parser.add_argument('--url', help='benchmark a running server '
+                            'instead of the in-process test client')
+    run_parser.add_argument('--only', help='run scenarios with this prefix')
+    run_parser.add_argument('--output', help='write the results as JSON')
+
+    compare_parser = commands.add_parser(
+        'compare', help='flag regressions against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='allowed relative p95 growth')
+    compare_parser.add_argument('--min-ms', type=float, default=1.0,
+                                help='ignore p95 changes smaller than this')
+
+    args = parser.parse_args(argv)
+    if args.command == 'seed':
+        return command_seed(args)
+    if args.command == 'run':
+        return command_run(args)
+    if args.command == 'compare':
+        return command_compare(args)
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+import base64
+import json
+import math
+import platform
+import resource
+import sys
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryCounter(object):
+    """Counts the SQL statements issued by the current thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+        event.listen(Engine, 'before_cursor_execute', self.count)
+
+    def count(self, conn, cursor, statement, parameters, context,
+              executemany):
+        self._local.queries = getattr(self._local, 'queries', 0) + 1
+
+    def reset(self):
+        self._local.queries = 0
+
+    @property
+    def queries(self):
+        return getattr(self._local, 'queries', 0)
+
+
+def basic_auth(username, password):
+    credentials = ('%s:%s' % (username, password)).encode('utf-8')
+    return {'Authorization': 'Basic ' +
+            base64.b64encode(credentials).decode('ascii')}
+
+
+class TestClient(object):
+    """Drives the application in-process through the Flask test client."""
+
+    counts_queries = True
+
+    def __init__(self, app, headers=None):
+        self.client = app.test_client(use_cookies=True)
+        self.headers = headers or {}
+
+    def request(self, method, path, json_body=None):
+        kwargs = {'headers': self.headers}
+        if json_body is not None:
+            kwargs['data'] = json.dumps(json_body)
+            kwargs['content_type'] = 'application/json'
+        response = self.client.open(path, method=method, **kwargs)
+        # drain streamed bodies so their queries and time are counted
+        return response.status_code, response.get_data()
+
+    def login(self, email, password):
+        self.client.post('/auth/login', data={'email': email,
+                                               'password': password})
+
+
+class HTTPClient(object):
+    """Drives a running server, e.g. gunicorn, over HTTP."""
+
+    counts_queries = False
+
+    def __init__(self, url, headers=None):
+        import requests
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.headers = headers or {}
+
+    def request(self, method, path, json_body=None):
+        response = self.session.request(method, self.url + path,
+                                        headers=self.headers, json=json_body)
+        return response.status_code, response.content
+
+    def login(self, email, password):
+        self.session.post(self.url + '/auth/login',
+                          data={'email': email, 'password': password})
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    index = max(int(math.ceil(fraction * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'count': len(latencies),
+        'mean_ms': total / len(latencies) * 1000 if latencies else None,
+        'p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 0.95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'throughput': len(latencies) / total if total else None,
+    }
+
+
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class Suite(object):
+    def __init__(self, make_client, fixtures, scenarios, counter=None):
+        self.make_client = make_client
+        self.fixtures = fixtures
+        self.scenarios = scenarios
+        self.counter = counter
+        self._clients = {}
+
+    def client(self, kind):
+        """Return a client for ``kind``, creating and authenticating it."""
+        if kind in self._clients:
+            return self._clients[kind]
+        email = self.fixtures['email']
+        password = self.fixtures['password']
+        if kind == 'basic':
+            client = self.make_client(basic_auth(email, password))
+        elif kind == 'api':
+            client = self.make_client(basic_auth(self.token(), ''))
+        else:
+            client = self.make_client()
+            if kind == 'web':
+                client.login(email, password)
+        self._clients[kind] = client
+        return client
+
+    def token(self):
+        client = self.make_client(basic_auth(self.fixtures['email'],
+                                             self.fixtures['password']))
+        status, body = client.request('GET', '/api/v1.0/token')
+        if status != 200:
+            raise RuntimeError('could not get an API token: %r' % body)
+        return json.loads(body.decode('utf-8'))['token']
+
+    def call(self, client, scenario):
+        path = scenario.path.format(**self.fixtures)
+        if self.counter is not None and client.counts_queries:
+            self.counter.reset()
+        started = time.perf_counter()
+        status, body = client.request(scenario.method, path,
+                                      scenario.body(self.fixtures))
+        elapsed = time.perf_counter() - started
+        size = len(body)
+        queries = self.counter.queries \
+            if self.counter is not None and client.counts_queries else None
+        return elapsed, status, size, queries
+
+    def run_sequential(self, iterations, warmup=2, log=None):
+        results = {}
+        for scenario in self.scenarios:
+            client = self.client(scenario.client)
+            count = scenario.iterations or iterations
+            for _ in range(min(warmup, count)):
+                self.call(client, scenario)
+            latencies = []
+            queries = []
+            errors = 0
+            size = 0
+            for _ in range(count):
+                elapsed, status, size, query_count = \
+                    self.call(client, scenario)
+                latencies.append(elapsed)
+                if query_count is not None:
+                    queries.append(query_count)
+                if status >= 400:
+                    errors += 1
+            result = summarize(latencies)
+            result.update({
+                'budget': scenario.budget,
+                'errors': errors,
+                'status': status,
+                'bytes': size,
+                'queries': {
+                    'min': min(queries),
+                    'max': max(queries),
+                    'mean': float(sum(queries)) / len(queries),
+                } if queries else None,
+            })
+            results[scenario.name] = result
+            if log is not None:
+                log(scenario.name, result)
+        return results
+
+    def run_concurrent(self, clients, requests):
+        """Spread ``requests`` read requests over ``clients`` threads."""
+        scenarios = [scenario for scenario in self.scenarios
+                     if scenario.concurrent]
+        # one authenticated client per thread, created up front
+        per_thread = []
+        for _ in range(clients):
+            self._clients = {}
+            per_thread.append(dict((kind, self.client(kind)) for kind in
+                                   set(s.client for s in scenarios)))
+        self._clients = {}
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def worker(index, own):
+            mine = []
+            failed = 0
+            for n in range(index, requests, clients):
+                scenario = scenarios[n % len(scenarios)]
+                elapsed, status, size, queries = \
+                    self.call(own[scenario.client], scenario)
+                mine.append(elapsed)
+                if status >= 400:
+                    failed += 1
+            with lock:
+                latencies.extend(mine)
+                errors[0] += failed
+
+        threads = [threading.Thread(target=worker, args=(index, own))
+                   for index, own in enumerate(per_thread)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - started
+        result = summarize(latencies)
+        result.update({
+            'clients': clients,
+            'seconds': seconds,
+            'errors': errors[0],
+            'throughput': len(latencies) / seconds if seconds else None,
+        })
+        return result
+
+
+def report(scale, sequential, concurrent):
+    return {
+        'scale': scale,
+        'created': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'endpoints': sequential,
+        'concurrent': concurrent,
+        'peak_rss_bytes': peak_rss(),
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_ms=1.0):
+    """Return ``(name, problem)`` pairs for every regression found.
+
+    An endpoint regresses when its p95 grows by more than ``threshold``
+    (and by at least ``min_ms``, to ignore timer noise), when it issues
+    more queries than in the baseline, or when it exceeds its budget.
+    """
+    problems = []
+    for name, now in sorted(current['endpoints'].items()):
+        before = baseline['endpoints'].get(name)
+        queries = now.get('queries')
+        if queries and now.get('budget') is not None and \
+                queries['max'] > now['budget']:
+            problems.append((name, '%d queries, budget is %d' %
+                             (queries['max'], now['budget'])))
+        if before is None:
+            continue
+        if before.get('p95_ms') and now.get('p95_ms') and \
+                now['p95_ms'] > before['p95_ms'] * (1 + threshold) and \
+                now['p95_ms'] - before['p95_ms'] >= min_ms:
+            problems.append((name, 'p95 %.2fms, was %.2fms' %
+                             (now['p95_ms'], before['p95_ms'])))
+        if queries and before.get('queries') and \
+                queries['max'] > before['queries']['max']:
+            problems.append((name, '%d queries, was %d' %
+                             (queries['max'], before['queries']['max'])))
+        if now.get('errors') and not before.get('errors'):
+            problems.append((name, '%d errors, was none' % now['errors']))
+    if baseline.get('concurrent') and current.get('concurrent'):
+        before = baseline['concurrent']['throughput']
+        now = current['concurrent']['throughput']
+        if before and now and now < before / (1 + threshold):
+            problems.append(('concurrent', 'throughput %.1f/s, was %.1f/s' %
+                             (now, before)))
+    return problems
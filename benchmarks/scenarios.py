@@ -0,0 +1,147 @@
+from app import db
+from app.models import Machine, Revision, Comment
+from .seed import ADMIN_EMAIL, PASSWORD
+
+
+class Scenario(object):
+    """One request the suite issues repeatedly.
+
+    ``path`` is formatted with the fixture ids and ``json`` may be a
+    callable taking them. ``budget`` is the most queries a single request
+    may issue; it must not grow with the page size, so an N+1 pattern
+    shows up as a budget violation. ``client`` is ``'api'`` (token auth),
+    ``'basic'`` (email and password), ``'web'`` (logged-in browser
+    session) or ``'anonymous'``.
+    """
+
+    def __init__(self, name, path, method='GET', json=None, budget=8,
+                 client='api', iterations=None, concurrent=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.json = json
+        self.budget = budget
+        self.client = client
+        self.iterations = iterations
+        if concurrent is None:
+            concurrent = method == 'GET' and iterations is None
+        self.concurrent = concurrent
+
+    def body(self, fixtures):
+        if callable(self.json):
+            return self.json(fixtures)
+        return self.json
+
+
+def machine_batch(fixtures):
+    return [{
+        'external_id': 'bench-machine-%d' % index,
+        'system_name': 'Benchmark machine %d' % index,
+        'system_notes': 'Created by the *benchmark* batch %d.' % index,
+    } for index in range(100)]
+
+
+def revision_batch(fixtures):
+    return [revision_spec(fixtures, i) for i in range(100)]
+
+
+def revision_spec(fixtures, index):
+    return {
+        'external_id': 'bench-%d' % index,
+        'machine_id': fixtures['machine'],
+        'cpu_make': 'Intel',
+        'cpu_name': 'Core i7-6700K',
+        'cpu_mhz': 4000,
+        'gpu_make': 'NVIDIA',
+        'gpu_name': 'GeForce GTX 1080',
+        'revision_notes': 'Benchmark revision %d' % index,
+    }
+
+
+API = '/api/v1.0'
+
+SCENARIOS = (
+    Scenario('api.get_token', API + '/token', client='basic', budget=4,
+             iterations=5),
+    Scenario('api.get_machines', API + '/machines/'),
+    Scenario('api.get_machines.cursor', API + '/machines/?cursor='),
+    Scenario('api.get_machines.expand', API + '/machines/'
+             '?expand=author,latest_revision', budget=10),
+    Scenario('api.get_machines.fields', API + '/machines/'
+             '?fields=url,system_name'),
+    Scenario('api.get_machine', API + '/machines/{machine}'),
+    Scenario('api.get_machine.expand', API + '/machines/{machine}'
+             '?expand=author,revisions,latest_revision,comments', budget=12),
+    Scenario('api.get_machine_revisions',
+             API + '/machines/{machine}/revisions/'),
+    Scenario('api.get_machine_comments',
+             API + '/machines/{machine}/comments/'),
+    Scenario('api.get_similar_machines',
+             API + '/machines/{machine}/similar?k=10'),
+    Scenario('api.find_similar_machines', API + '/machines/similar',
+             method='POST', json={'cpu_make': 'AMD', 'cpu_mhz': 4000,
+                                  'system_memory_mb': 16384},
+             concurrent=True),
+    Scenario('api.get_revisions', API + '/revisions/'),
+    Scenario('api.get_revisions.fields', API + '/revisions/'
+             '?fields=cpu_name,gpu_name'),
+    Scenario('api.get_revision', API + '/revisions/{revision}'),
+    Scenario('api.search_revisions', API + '/revisions/search'
+             '?cpu_make=Intel&cpu_mhz_min=3500&system_memory_mb_min=8192'),
+    Scenario('api.get_comments', API + '/comments/'),
+    Scenario('api.get_comment', API + '/comments/{comment}'),
+    Scenario('api.get_user', API + '/users/{user}'),
+    Scenario('api.get_user_machines', API + '/users/{user}/machines/'),
+    Scenario('api.search', API + '/search?q=lorem+ipsum'),
+    Scenario('api.get_stats', API + '/stats/'),
+    Scenario('api.get_dimension_stats', API + '/stats/cpu_make'),
+    Scenario('api.get_metrics', API + '/metrics'),
+    Scenario('api.export_machines', API + '/export/machines', iterations=3),
+    Scenario('api.export_revisions', API + '/export/revisions', iterations=3),
+    Scenario('api.export_comments', API + '/export/comments', iterations=3),
+    Scenario('api.export_revisions.csv', API + '/export/revisions.csv',
+             iterations=3),
+    Scenario('api.new_machine', API + '/machines/', method='POST',
+             json={'system_name': 'Benchmark machine',
+                   'system_notes': 'Created by the *benchmark* suite.'},
+             budget=12),
+    Scenario('api.edit_machine', API + '/machines/{machine}', method='PUT',
+             json={'system_notes': 'Edited by the *benchmark* suite.'},
+             budget=12),
+    Scenario('api.edit_revision', API + '/revisions/{revision}', method='PUT',
+             json={'revision_notes': 'Edited by the *benchmark* suite.'},
+             budget=12),
+    Scenario('api.new_machine_revision', API + '/machines/{machine}/revisions/',
+             method='POST', json={'cpu_make': 'AMD', 'cpu_name': 'FX-8350',
+                                  'cpu_mhz': 4000}, budget=15),
+    Scenario('api.new_machine_comment', API + '/machines/{machine}/comments/',
+             method='POST', json={'body': 'Benchmark *comment*'}, budget=12),
+    Scenario('api.machines_batch', API + '/machines/batch', method='POST',
+             json=machine_batch, budget=20, iterations=5),
+    Scenario('api.revisions_batch', API + '/revisions/batch', method='POST',
+             json=revision_batch, budget=30,
+             iterations=5),
+    Scenario('main.index', '/', client='web', budget=10),
+    Scenario('main.user', '/user/bench', client='web', budget=10),
+    Scenario('main.edit_profile', '/edit-profile', client='web'),
+    Scenario('auth.login', '/auth/login', client='anonymous', budget=2),
+    Scenario('auth.change_password', '/auth/change-password', client='web'),
+)
+
+
+def fixtures():
+    """Return the ids the scenario paths refer to."""
+    machine = db.session.query(Machine.id).order_by(
+        Machine.revision_count.desc(), Machine.id).first()
+    machine_id = machine[0] if machine else 1
+    revision = db.session.query(db.func.max(Revision.id)).filter(
+        Revision.machine_id == machine_id).scalar()
+    comment = db.session.query(db.func.max(Comment.id)).scalar()
+    return {
+        'machine': machine_id,
+        'revision': revision or 1,
+        'comment': comment or 1,
+        'user': 1,
+        'email': ADMIN_EMAIL,
+        'password': PASSWORD,
+    }
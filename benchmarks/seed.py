@@ -0,0 +1,40 @@
+from app import db
+from app.models import Role, User, TableVersion
+from app.seed import Seeder
+
+# number of revisions at each scale; the other tables are sized from it
+SCALES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+ADMIN_EMAIL = 'bench@example.com'
+PASSWORD = 'bench'
+
+
+def sizes(revisions):
+    return {
+        'users': max(revisions // 100, 10),
+        'machines': max(revisions // 4, 1),
+        'revisions': revisions,
+        'comments': revisions // 2,
+    }
+
+
+def seed(scale, seed=0, batch_size=5000):
+    """Recreate the database with deterministic fake data.
+
+    The administrator the suite logs in as is always user 1.
+    """
+    db.drop_all()
+    db.create_all()
+    Role.insert_roles()
+    TableVersion.insert_tables()
+    admin = User(email=ADMIN_EMAIL, username='bench', password=PASSWORD,
+                 confirmed=True,
+                 role=Role.query.filter_by(name='Administrator').first())
+    db.session.add(admin)
+    db.session.commit()
+    return Seeder(seed=seed, batch_size=batch_size, password=PASSWORD).run(
+        **sizes(SCALES[scale]))
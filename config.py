@@ -4,9 +4,11 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard to guess string'
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
-    MAIL_SERVER = 'smtp.googlemail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.googlemail.com'
+    MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
+    MAIL_USE_TLS = (os.environ.get('MAIL_USE_TLS') or '1').lower() in \
+        ('1', 'true', 'yes')
+    MAIL_MAX_EMAILS = 100
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     RIVALROCKETS_MAIL_SUBJECT_PREFIX = '[Rival Rockets Bench]'
@@ -16,6 +18,53 @@ class Config:
     RIVALROCKETS_REVISIONS_PER_PAGE = 5
     RIVALROCKETS_COMMENTS_PER_PAGE = 20
     RIVALROCKETS_SLOW_DB_QUERY_TIME = 0.5
+    RIVALROCKETS_COUNT_CACHE_TTL = 60
+    RIVALROCKETS_BATCH_MAX_RECORDS = 5000
+    RIVALROCKETS_EXPORT_BATCH_SIZE = 1000
+    RIVALROCKETS_HARDWARE_INDEX_MAX_AGE = 300
+    RIVALROCKETS_SIMILARITY_INDEX_MAX_AGE = 900
+    RIVALROCKETS_SIMILAR_MACHINES_MAX = 50
+    RIVALROCKETS_SEARCH_RESULTS_PER_PAGE = 20
+    RIVALROCKETS_TOKEN_CACHE_TTL = 300
+    RIVALROCKETS_USER_CACHE_TTL = 30
+    RIVALROCKETS_CREDENTIAL_CACHE_TTL = 60
+    RIVALROCKETS_HASH_POOL = os.environ.get('HASH_POOL') or 'thread'
+    RIVALROCKETS_HASH_WORKERS = int(os.environ.get('HASH_WORKERS') or 2)
+    RIVALROCKETS_HASH_QUEUE_DEPTH = 16
+    RIVALROCKETS_LAST_SEEN_RESOLUTION = 60
+    RIVALROCKETS_LAST_SEEN_FLUSH_INTERVAL = 30
+    RIVALROCKETS_DEFERRED_RENDER = bool(os.environ.get('DEFERRED_RENDER'))
+    RIVALROCKETS_API_CACHE_BACKEND = os.environ.get('API_CACHE_BACKEND') or \
+        'local'
+    RIVALROCKETS_API_CACHE_URL = os.environ.get('API_CACHE_URL')
+    RIVALROCKETS_API_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    RIVALROCKETS_API_CACHE_DEFAULT_TTL = 60
+    RIVALROCKETS_API_CACHE_TTLS = {
+        'api.get_machines': 30,
+        'api.get_revisions': 30,
+        'api.get_comments': 15,
+        'api.get_machine_comments': 15,
+        'api.get_user': 30,
+    }
+    RIVALROCKETS_API_COMPRESS_MIN_BYTES = 1024
+    RIVALROCKETS_API_COMPRESS_LEVEL = 6
+    RIVALROCKETS_DATABASE_REPLICAS = [
+        url for url in
+        (os.environ.get('DATABASE_REPLICA_URLS') or '').split(',') if url]
+    RIVALROCKETS_REPLICA_POOL_SIZE = None
+    RIVALROCKETS_REPLICA_RETRY_INTERVAL = 30
+    RIVALROCKETS_READ_AFTER_WRITE_SECONDS = 10
+    RIVALROCKETS_METRICS_DIR = os.environ.get('METRICS_DIR')
+    RIVALROCKETS_METRICS_FLUSH_INTERVAL = 15
+    RIVALROCKETS_MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    RIVALROCKETS_MAIL_QUEUE_DEPTH = 1000
+    RIVALROCKETS_MAIL_IDLE_TIMEOUT = 5
+    RIVALROCKETS_MAIL_RETRIES = 3
+    RIVALROCKETS_MAIL_RETRY_BACKOFF = 2
+    RIVALROCKETS_MAIL_SHUTDOWN_TIMEOUT = 10
+    RIVALROCKETS_LOG_QUEUE_DEPTH = 10000
+    RIVALROCKETS_ERROR_DIGEST_INTERVAL = 300
+    RIVALROCKETS_ACCESS_LOG = bool(os.environ.get('ACCESS_LOG'))
 
     @staticmethod
     def init_app(app):
@@ -33,6 +82,18 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
     WTF_CSRF_ENABLED = False
+    RIVALROCKETS_API_CACHE_BACKEND = 'shared'
+    RIVALROCKETS_MAIL_WORKERS = 0
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URL') or \
+        'sqlite:///' + os.path.join(basedir, 'data-bench.sqlite')
+    WTF_CSRF_ENABLED = False
+    MAIL_SUPPRESS_SEND = True
+    SSL_DISABLE = True
+    # measure the views and their queries, not response cache hits
+    RIVALROCKETS_API_CACHE_BACKEND = 'none'
 
 
 class ProductionConfig(Config):
@@ -43,9 +104,14 @@ class ProductionConfig(Config):
     def init_app(cls, app):
         Config.init_app(app)
 
-        # email errors to the administrators
+        # log from a background thread, so requests never wait on I/O
         import logging
+        import sys
         from logging.handlers import SMTPHandler
+        from app.log import LogPipeline, ErrorDigestHandler
+        pipeline = LogPipeline.of(app)
+
+        # email errors to the administrators, a digest at a time
         credentials = None
         secure = None
         if getattr(cls, 'MAIL_USERNAME', None) is not None:
@@ -56,11 +122,16 @@ class ProductionConfig(Config):
             mailhost=(cls.MAIL_SERVER, cls.MAIL_PORT),
             fromaddr=cls.RIVALROCKETS_MAIL_SENDER,
             toaddrs=[cls.RIVALROCKETS_ADMIN],
-            subject=cls.RIVALROCKETS_MAIL_SUBJECT_PREFIX + ' Application Error',
+            subject=cls.RIVALROCKETS_MAIL_SUBJECT_PREFIX + ' Application Errors',
             credentials=credentials,
             secure=secure)
-        mail_handler.setLevel(logging.ERROR)
-        app.logger.addHandler(mail_handler)
+        digest_handler = ErrorDigestHandler(
+            mail_handler, cls.RIVALROCKETS_ERROR_DIGEST_INTERVAL)
+        digest_handler.setLevel(logging.ERROR)
+        pipeline.add_handler(digest_handler)
+
+        if cls.RIVALROCKETS_ACCESS_LOG:
+            pipeline.log_access(logging.StreamHandler(sys.stdout))
 
 
 class HerokuConfig(ProductionConfig):
@@ -75,11 +146,13 @@ class HerokuConfig(ProductionConfig):
         from logging import StreamHandler
         file_handler = StreamHandler()
         file_handler.setLevel(logging.WARNING)
-        app.logger.addHandler(file_handler)
+        from app.log import LogPipeline
+        LogPipeline.of(app).add_handler(file_handler)
 
 config = {
     'development': DevelopmentConfig,
     'testing': TestingConfig,
+    'benchmark': BenchmarkConfig,
     'production': ProductionConfig,
     'heroku': HerokuConfig,
 
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 import os
 from app import create_app, db
-from app.models import User, Role, Permission, Machine, Comment
+from app.models import User, Role, Permission, Machine, Comment, Revision, \
+    TableVersion
 from flask_script import Manager, Shell
 from flask_migrate import Migrate, MigrateCommand
 
@@ -12,7 +13,8 @@ migrate = Migrate(app, db)
 
 def make_shell_context():
     return dict(app=app, db=db, User=User, Role=Role, Machine=Machine,
-                Permission=Permission, Comment=Comment, Revision=Revision)
+                Permission=Permission, Comment=Comment, Revision=Revision,
+                TableVersion=TableVersion)
 
 manager.add_command("shell", Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
@@ -21,7 +23,7 @@ manager.add_command('db', MigrateCommand)
 def deploy():
     """Run deployment tasks."""
     from flask_migrate import upgrade
-    from app.models import Role, User
+    from app.models import Role, User, TableVersion
 
     # migrate database to latest revision
     upgrade()
@@ -29,6 +31,141 @@ def deploy():
     # create user roles
     Role.insert_roles()
 
+    # seed the per-table version counters used for API ETags
+    TableVersion.insert_tables()
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=500)
+@manager.option('-p', '--processes', dest='processes', type=int,
+                default=None)
+def render_html(batch_size, processes):
+    """Re-render every Markdown field to HTML in parallel batches."""
+    from multiprocessing import Pool
+    from sqlalchemy import bindparam
+    from app import response_cache
+    from app.models import RENDERED_FIELDS
+    from app.rendering import render_markdown
+
+    pool = Pool(processes)
+    try:
+        for model, source, html in RENDERED_FIELDS:
+            table = model.__table__
+            update = table.update().where(table.c.id == bindparam('row_id')).\
+                values({html: bindparam('html')})
+            last_id = 0
+            while True:
+                # the columns cache_tags reads come along for the ride
+                rows = db.session.execute(
+                    db.select([table.c.id, table.c[source]] +
+                              [table.c[name] for name in ('author_id',
+                                                          'machine_id')
+                               if name in table.c]).
+                    where(table.c.id > last_id).
+                    order_by(table.c.id).limit(batch_size)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                rows = [row for row in rows if row[1] is not None]
+                rendered = pool.map(render_markdown, [row[1] for row in rows])
+                if rows:
+                    db.session.execute(update, [
+                        {'row_id': row[0], 'html': value}
+                        for row, value in zip(rows, rendered)])
+                    TableVersion.bump(db.session, [table.name])
+                db.session.commit()
+                response_cache.invalidate(*set(
+                    tag for row in rows for tag in model.cache_tags(row)))
+                print('%s: rendered up to id %d' % (table.name, last_id))
+    finally:
+        pool.close()
+        pool.join()
+
+
+@manager.option('-f', '--format', dest='format', default='csv',
+                help='csv, npz or arrow')
+@manager.option('-o', '--output', dest='output', required=True)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=10000)
+def export_revisions(format, output, batch_size):
+    """Export revision hardware specs in a columnar format."""
+    from app.columnar import write_revisions
+    connection = db.engine.connect()
+    try:
+        with open(output, 'wb') as f:
+            write_revisions(connection, format, f, batch_size)
+    finally:
+        connection.close()
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=1000)
+def rebuild_search(batch_size):
+    """Rebuild the full-text search index in batches."""
+    from app import fulltext_index
+    with db.engine.begin() as connection:
+        fulltext_index.create_table(None, connection)
+        for kind, last_id in fulltext_index.rebuild(connection, batch_size):
+            print('%s: indexed up to id %d' % (kind, last_id))
+
+
+@manager.command
+def rebuild_rollups():
+    """Recompute the hardware rollup tables from the revisions."""
+    from app.models import HardwareRollup
+    HardwareRollup.rebuild(db.session)
+    TableVersion.bump(db.session, ['hardware_rollups'])
+    db.session.commit()
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=None)
+@manager.option('-m', '--machines', dest='machines', type=int, default=None)
+@manager.option('-r', '--revisions', dest='revisions', type=int,
+                default=100000)
+@manager.option('-c', '--comments', dest='comments', type=int, default=None)
+@manager.option('-s', '--seed', dest='seed', type=int, default=0)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=10000)
+@manager.option('-p', '--processes', dest='processes', type=int,
+                default=None)
+def seed(users, machines, revisions, comments, seed, batch_size, processes):
+    """Append generated users, machines, revisions and comments."""
+    from app.seed import Seeder
+    counts = Seeder(seed=seed, batch_size=batch_size,
+                    processes=processes).run(
+        users=max(revisions // 100, 10) if users is None else users,
+        machines=max(revisions // 4, 1) if machines is None else machines,
+        revisions=revisions,
+        comments=revisions // 2 if comments is None else comments)
+    print('seeded %s' % ', '.join('%d %s' % (count, table) for table, count
+                                  in sorted(counts.items())))
+
+
+@manager.command
+def copy_replicas():
+    """Copy a SQLite primary database over its SQLite replicas."""
+    import shutil
+    from sqlalchemy.engine.url import make_url
+    primary = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if primary.drivername != 'sqlite' or not primary.database:
+        raise ValueError('copy_replicas needs a file-based SQLite primary')
+    # flush the write-ahead log, if any, into the main database file
+    db.engine.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    for spec in app.config['RIVALROCKETS_DATABASE_REPLICAS']:
+        url = make_url(spec['url'] if isinstance(spec, dict) else spec)
+        if url.drivername != 'sqlite' or not url.database:
+            print('skipping non-SQLite replica %s' % url.__to_string__())
+            continue
+        shutil.copyfile(primary.database, url.database)
+        print('copied %s to %s' % (primary.database, url.database))
+
+
+@manager.command
+def reconcile_counters():
+    """Recompute the denormalized machine, revision and comment counts."""
+    from app.models import reconcile_counters
+    reconcile_counters()
+
 
 if __name__ == '__main__':
     manager.run()
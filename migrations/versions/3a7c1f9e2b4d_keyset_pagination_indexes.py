@@ -0,0 +1,32 @@
+"""keyset pagination indexes
+
+Revision ID: 3a7c1f9e2b4d
+Revises: ef06bb737416
+Create Date: 2026-10-17 09:12:41.318024
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a7c1f9e2b4d'
+down_revision = 'ef06bb737416'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_machines_timestamp_id', 'machines', ['timestamp', 'id'], unique=False)
+    op.create_index('ix_machines_author_id_timestamp', 'machines', ['author_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_comments_timestamp_id', 'comments', ['timestamp', 'id'], unique=False)
+    op.create_index('ix_comments_machine_id_timestamp', 'comments', ['machine_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_revisions_timestamp_id', 'revisions', ['timestamp', 'id'], unique=False)
+    op.create_index('ix_revisions_machine_id_timestamp', 'revisions', ['machine_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_revisions_machine_id_timestamp', table_name='revisions')
+    op.drop_index('ix_revisions_timestamp_id', table_name='revisions')
+    op.drop_index('ix_comments_machine_id_timestamp', table_name='comments')
+    op.drop_index('ix_comments_timestamp_id', table_name='comments')
+    op.drop_index('ix_machines_author_id_timestamp', table_name='machines')
+    op.drop_index('ix_machines_timestamp_id', table_name='machines')
@@ -0,0 +1,30 @@
+"""external ids
+
+Revision ID: 5f8a2d4c1e67
+Revises: c41f0a6d93e8
+Create Date: 2026-10-17 13:48:19.620441
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5f8a2d4c1e67'
+down_revision = 'c41f0a6d93e8'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('machines', sa.Column('external_id', sa.String(length=64), nullable=True))
+    op.add_column('revisions', sa.Column('external_id', sa.String(length=64), nullable=True))
+    op.create_index('ix_machines_author_id_external_id', 'machines', ['author_id', 'external_id'], unique=True)
+    op.create_index('ix_revisions_author_id_external_id', 'revisions', ['author_id', 'external_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_revisions_author_id_external_id', table_name='revisions')
+    op.drop_index('ix_machines_author_id_external_id', table_name='machines')
+    with op.batch_alter_table('revisions') as batch_op:
+        batch_op.drop_column('external_id')
+    with op.batch_alter_table('machines') as batch_op:
+        batch_op.drop_column('external_id')
@@ -0,0 +1,29 @@
+"""updated at
+
+Revision ID: 6b1e9f3a5c28
+Revises: d27b9c4e8a31
+Create Date: 2026-10-17 19:05:12.482913
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b1e9f3a5c28'
+down_revision = 'd27b9c4e8a31'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    for table in ('machines', 'revisions', 'comments'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        # existing rows were last changed no earlier than they were created
+        op.execute('UPDATE %s SET updated_at = timestamp' % table)
+        op.create_index(op.f('ix_%s_updated_at' % table), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in ('comments', 'revisions', 'machines'):
+        op.drop_index(op.f('ix_%s_updated_at' % table), table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,44 @@
+"""denormalized counters
+
+Revision ID: 8d2e5b1c7a90
+Revises: 3a7c1f9e2b4d
+Create Date: 2026-10-17 10:03:27.551902
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d2e5b1c7a90'
+down_revision = '3a7c1f9e2b4d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('users', sa.Column('machine_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('machines', sa.Column('revision_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('machines', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+
+    # backfill the counters of existing rows
+    op.execute('UPDATE users SET machine_count = '
+               '(SELECT count(machines.id) FROM machines '
+               'WHERE machines.author_id = users.id)')
+    op.execute('UPDATE users SET comment_count = '
+               '(SELECT count(comments.id) FROM comments '
+               'WHERE comments.author_id = users.id)')
+    op.execute('UPDATE machines SET revision_count = '
+               '(SELECT count(revisions.id) FROM revisions '
+               'WHERE revisions.machine_id = machines.id)')
+    op.execute('UPDATE machines SET comment_count = '
+               '(SELECT count(comments.id) FROM comments '
+               'WHERE comments.machine_id = machines.id)')
+
+
+def downgrade():
+    with op.batch_alter_table('machines') as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('revision_count')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('machine_count')
@@ -0,0 +1,28 @@
+"""search document rowids
+
+Revision ID: 9c4d7e2f1a63
+Revises: 6b1e9f3a5c28
+Create Date: 2026-10-18 10:12:40.305117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9c4d7e2f1a63'
+down_revision = '6b1e9f3a5c28'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # re-index so every SQLite document sits at the rowid its kind and id
+    # map to
+    from app.fulltext import FullTextIndex
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        for kind, last_id in FullTextIndex().rebuild(bind):
+            pass
+
+
+def downgrade():
+    pass
@@ -0,0 +1,28 @@
+"""full text search
+
+Revision ID: a93d6e0b2f15
+Revises: 5f8a2d4c1e67
+Create Date: 2026-10-17 15:02:33.874410
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a93d6e0b2f15'
+down_revision = '5f8a2d4c1e67'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    from app.fulltext import FullTextIndex
+    bind = op.get_bind()
+    index = FullTextIndex()
+    index.create_table(None, bind)
+    # index the documents that already exist
+    for kind, last_id in index.rebuild(bind):
+        pass
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS search_documents')
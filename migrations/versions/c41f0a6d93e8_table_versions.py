@@ -0,0 +1,29 @@
+"""table versions
+
+Revision ID: c41f0a6d93e8
+Revises: 8d2e5b1c7a90
+Create Date: 2026-10-17 11:26:05.107436
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c41f0a6d93e8'
+down_revision = '8d2e5b1c7a90'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': name, 'version': 0}
+        for name in ('roles', 'users', 'machines', 'comments', 'revisions')])
+
+
+def downgrade():
+    op.drop_table('table_versions')
@@ -0,0 +1,40 @@
+"""hardware rollups
+
+Revision ID: d27b9c4e8a31
+Revises: a93d6e0b2f15
+Create Date: 2026-10-17 16:21:50.093157
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd27b9c4e8a31'
+down_revision = 'a93d6e0b2f15'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('hardware_rollups',
+    sa.Column('dimension', sa.String(length=16), nullable=False),
+    sa.Column('value', sa.String(length=64), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('revision_count', sa.Integer(), nullable=False),
+    sa.Column('cpu_mhz_sum', sa.BigInteger(), nullable=False),
+    sa.Column('cpu_mhz_count', sa.Integer(), nullable=False),
+    sa.Column('cpu_proc_cores_sum', sa.BigInteger(), nullable=False),
+    sa.Column('cpu_proc_cores_count', sa.Integer(), nullable=False),
+    sa.Column('system_memory_mb_sum', sa.BigInteger(), nullable=False),
+    sa.Column('system_memory_mb_count', sa.Integer(), nullable=False),
+    sa.Column('gpu_memory_mb_sum', sa.BigInteger(), nullable=False),
+    sa.Column('gpu_memory_mb_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('dimension', 'value', 'month')
+    )
+
+    # populate the rollups from the existing revisions
+    from app.models import HardwareRollup
+    HardwareRollup.rebuild(op.get_bind())
+
+
+def downgrade():
+    op.drop_table('hardware_rollups')